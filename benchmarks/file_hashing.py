@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""Microbenchmark of the throughput of hashing files, compared with the
+throughput of just reading them. Usage:
+
+    python benchmarks/file_hashing.py [PATH | SIZE_IN_MB] [ALGORITHM]
+
+This hashes the file at PATH (or a temporary file of random data that
+is SIZE_IN_MB megabytes) twice with every method: once after evicting
+the file from the page cache, which measures how fast it is hashed
+from disk, and once more when the file is already in the page cache.
+The file is evicted with posix_fadvise; where that is not available,
+only the page cache numbers are meaningful unless the page cache is
+dropped by hand (`echo 3 > /proc/sys/vm/drop_caches` on linux, as root)
+before every cold pass.
+"""
+
+import ctypes
+import ctypes.util
+import io
+import mmap
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from workflow.resources import hashing  # noqa
+
+BLOCK_SIZE = 2**20
+
+# value of POSIX_FADV_DONTNEED on linux, for pythons without os.posix_fadvise
+POSIX_FADV_DONTNEED = getattr(os, 'POSIX_FADV_DONTNEED', 4)
+
+
+def evict(path):
+    """Evict the file from the page cache so that the next pass reads it
+    from disk. Returns whether the file was evicted.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        # only pages that were written to disk can be evicted
+        os.fsync(fd)
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, 0, 0, POSIX_FADV_DONTNEED)
+            return True
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(libc, 'posix_fadvise'):
+            return False
+        return libc.posix_fadvise(fd, 0, 0, POSIX_FADV_DONTNEED) == 0
+    finally:
+        os.close(fd)
+
+
+def read_only(path, algorithm):
+    """Read the file into a reused buffer without hashing it, which is as
+    fast as hashing can possibly be
+    """
+    data = bytearray(BLOCK_SIZE)
+    with io.open(path, 'rb', buffering=0) as stream:
+        while stream.readinto(data):
+            pass
+
+
+def hash_read(path, algorithm):
+    """Hash the file by reading a new string for every block"""
+    state = hashing.new_hash(algorithm)
+    with open(path) as stream:
+        for data in iter(lambda: stream.read(BLOCK_SIZE), ''):
+            state.update(data)
+
+
+def hash_readinto(path, algorithm):
+    """Hash the file like FileSystem.hash_file does"""
+    state = hashing.new_hash(algorithm)
+    with io.open(path, 'rb', buffering=0) as stream:
+        hashing.update_from_stream(state, stream, BLOCK_SIZE)
+
+
+def hash_mmap(path, algorithm):
+    """Hash the file from a memory map"""
+    state = hashing.new_hash(algorithm)
+    with open(path, 'rb') as stream:
+        data = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        for offset in range(0, len(data), BLOCK_SIZE):
+            state.update(buffer(data, offset, BLOCK_SIZE))
+        data.close()
+
+
+def throughput(func, path, algorithm):
+    size_mb = os.path.getsize(path) / float(BLOCK_SIZE)
+    t0 = time.time()
+    func(path, algorithm)
+    return size_mb / (time.time() - t0)
+
+
+def benchmark(path, algorithm):
+    print "%-16s%16s%16s" % ("", "cold", "page cache")
+    for func in (read_only, hash_read, hash_readinto, hash_mmap):
+        cold = "%10.1f MB/s" % throughput(func, path, algorithm) \
+            if evict(path) else "?"
+        warm = "%10.1f MB/s" % throughput(func, path, algorithm)
+        print "%-16s%16s%16s" % (func.__name__, cold, warm)
+
+
+def main(path_or_size='512', algorithm=hashing.DEFAULT_ALGORITHM):
+    if os.path.exists(path_or_size):
+        benchmark(path_or_size, algorithm)
+        return
+    fd, path = tempfile.mkstemp()
+    try:
+        with os.fdopen(fd, 'wb') as stream:
+            for i in range(int(path_or_size)):
+                stream.write(os.urandom(BLOCK_SIZE))
+        benchmark(path, algorithm)
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
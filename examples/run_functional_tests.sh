@@ -37,14 +37,14 @@ validate_example () {
     workflow archive --exclude-internals
     exit_code=$(expr ${exit_code} + $?)
 
-    # hack to compute checksum of resulting archive since tarballs of
-    # files with the same content are apparently not guaranteed to
-    # have the same md5 hash
-    temp_dir=/tmp/${example}
-    mkdir -p ${temp_dir}
-    tar -xf .workflow/archive/* -C ${temp_dir}
-    local_checksum=$(find ${temp_dir}/ -type f | sort | xargs cat | md5)
-    rm -rf ${temp_dir}
+    # compute the checksum of the contents of all of the archived files
+    # from the blobs that are listed in the manifest of the archive
+    archive_dir=.workflow/archive
+    local_checksum=$(tr -d '\r' < ${archive_dir}/*.csv | sort -t, -k1,1 | \
+	while IFS=, read path mode state stat; do
+	    digest=${state#*:}
+	    bzip2 -dc ${archive_dir}/blobs/${digest:0:2}/${state/:/-}.bz2
+	done | md5)
     if [ "${local_checksum}" != "${test_checksum}" ]; then
         red "ERROR--CHECKSUM OF ${example} DOES NOT MATCH"
         red "    local checksum=${local_checksum}"
@@ -53,12 +53,37 @@ validate_example () {
     fi
 }
 
+# function for running test on an example that has a failing task to
+# validate that only the failed task is re-run after a failed run. the
+# tasks of the example record every time that they run in data/runs.txt
+validate_failed_example () {
+    example=$1
+    test_runs=$2
+    cd $BASEDIR/${example}
+    workflow clean --force --include-internals
+    rm -f data/runs.txt
+    workflow run --jobs 1
+    workflow run --jobs 1
+    if [ $? -eq 0 ]; then
+        red "ERROR--${example} DID NOT FAIL"
+        exit_code=$(expr ${exit_code} + 1)
+    fi
+    local_runs=$(cat data/runs.txt | tr '\n' ' ')
+    if [ "${local_runs}" != "${test_runs}" ]; then
+        red "ERROR--TASKS OF ${example} DID NOT RUN AS EXPECTED"
+        red "    local runs=${local_runs}"
+        red "     test runs=${test_runs}"
+        exit_code=$(expr ${exit_code} + 1)
+    fi
+}
+
 # run a few examples to make sure the checksums match what they are
 # supposed to. if you update an example, be sure to update the
 # checksum by just running this script and determining what the
 # correct checksum is
 validate_example hello-world fb8915998f1095695ec34bc579bb41e6
 validate_example model-correlations c07223b877e49ff8bb4559c2829cdd47
+validate_failed_example failed-task "a c b b "
 
 # exit with the sum of the status
 exit ${exit_code}
@@ -2,6 +2,7 @@
 from base.BaseCommand.
 """
 import os
+import sys
 import argparse
 import pkgutil
 from importlib import import_module
@@ -22,10 +23,33 @@ def _iter_command_cls():
             yield command_cls
 
 
-def get_command_line_parser():
+def _get_argv():
+    """Get the command line arguments, which argcomplete passes through
+    the environment when completing a command line
+    """
+    if '_ARGCOMPLETE' in os.environ:
+        comp_line = os.environ.get('COMP_LINE', '')
+        comp_point = int(os.environ.get('COMP_POINT', len(comp_line)))
+        return comp_line[:comp_point].split()[1:]
+    return sys.argv[1:]
+
+
+def _get_selected_command_name(argv):
+    """The name of the subcommand is the first positional argument"""
+    for arg in argv:
+        if not arg.startswith('-'):
+            return arg
+
+
+def get_command_line_parser(argv=None):
     """Public function for creating a parser to execute all of the commands
-    in this sub-package.
+    in this sub-package. Only the options of the subcommand that is
+    selected in `argv` are added so that nothing expensive (like
+    loading the task graph) is done for any of the other subcommands.
     """
+    if argv is None:
+        argv = _get_argv()
+    selected_command_name = _get_selected_command_name(argv)
     command_line_parser = argparse.ArgumentParser(
         description="Execute data workflows defined in workflow.yaml files",
     )
@@ -34,6 +58,8 @@ def get_command_line_parser():
     )
     for command_cls in _iter_command_cls():
         command = command_cls(subcommand_creator)
+        if command.get_command_name() == selected_command_name:
+            command.add_command_line_options()
 
         # this sets a default value for the command "option" so
         # that, when this Command is selected by argparse from the
@@ -1,31 +1,54 @@
-from .base import BaseCommand
+import sys
 
+from ..exceptions import CommandLineException
+from .base import BaseCommand, TaskIdMixin
 
-class Command(BaseCommand):
+
+class Command(BaseCommand, TaskIdMixin):
     help_text = "Create and restore backup archives of workflows."
 
-    def execute(self, restore=False, exclude_internals=False):
-        if restore:
-            self.task_graph.restore_archive(restore)
+    def execute(self, restore=False, exclude_internals=False, task_ids=None):
+        if restore is None:
+            self.option_parser.error("there are no archives to restore")
+        elif restore:
+            try:
+                self.task_graph.restore_archive(restore, task_ids)
+            except CommandLineException, e:
+                print(e)
+                sys.exit(1)
+        elif task_ids:
+            self.option_parser.error(
+                "tasks can only be specified to --restore their creates"
+            )
         else:
             self.task_graph.write_archive(exclude_internals=exclude_internals)
 
     def add_command_line_options(self):
 
-        # get the available archives if the task_graph was found
+        # get the available archives if the task_graph was found. the
+        # most recent archive is restored by default
         available_archives = []
         if self.task_graph is not None:
             available_archives = self.task_graph.get_available_archives()
 
         self.option_parser.add_argument(
             '--restore',
+            metavar='ARCHIVE',
             choices=available_archives,
             default=False,
+            const=(available_archives or [None])[-1],
             nargs='?',
-            help="Restore the state of the workflow."
+            help=(
+                "Restore the state of the workflow (by default, from the "
+                "most recent archive)."
+            ),
         )
         self.option_parser.add_argument(
             '--exclude-internals',
             action="store_true",
             help="exclude internals in the .workflow/ directory from archive",
         )
+        self.add_task_ids_option(
+            "Only restore the `creates` of these tasks (or wildcard "
+            "patterns of tasks)."
+        )
@@ -1,4 +1,4 @@
-from ..parser import load_task_graph
+from ..parser import load_task_graph, load_task_ids
 from ..exceptions import ConfigurationNotFound
 
 
@@ -7,19 +7,28 @@ class BaseCommand(object):
 
     def __init__(self, subcommand_creator):
 
-        try:
-            self.task_graph = load_task_graph()
-        except ConfigurationNotFound:
-            self.task_graph = None
-
-        # set up the subcommand options
+        # set up the subcommand. its options are only added (with
+        # add_command_line_options) when this subcommand is selected
         self.subcommand_creator = subcommand_creator
         self.option_parser = self.subcommand_creator.add_parser(
             self.get_command_name(),
             help=self.help_text,
             description=self.help_text,
         )
-        self.add_command_line_options()
+
+    @property
+    def task_graph(self):
+        """The task graph is only loaded the first time it is needed"""
+        if not hasattr(self, '_task_graph'):
+            try:
+                self._task_graph = load_task_graph()
+            except ConfigurationNotFound:
+                self._task_graph = None
+        return self._task_graph
+
+    @task_graph.setter
+    def task_graph(self, task_graph):
+        self._task_graph = task_graph
 
     def get_command_name(self):
         """The command name defaults to the name of the module."""
@@ -32,24 +41,64 @@ class BaseCommand(object):
         raise NotImplementedError("must be overwritten by base classes")
 
 
+def complete_task_ids(prefix, **kwargs):
+    """Complete task ids on the command line from the index of task ids
+    rather than loading the entire task graph
+    """
+    try:
+        task_ids = load_task_ids()
+    except ConfigurationNotFound:
+        return []
+    return [task_id for task_id in task_ids if task_id.startswith(prefix)]
+
+
+class TaskIdChoices(object):
+    """The task ids that are valid choices on the command line. These are
+    only loaded from the task graph when a task id is validated.
+    """
+
+    def __init__(self, command):
+        self.command = command
+
+    def get_task_ids(self):
+        if self.command.task_graph is None:
+            return []
+        return self.command.task_graph.get_task_ids()
+
+    def __contains__(self, task_id):
+        return task_id in self.get_task_ids()
+
+    def __iter__(self):
+        return iter(self.get_task_ids())
+
+
 class TaskIdMixin(object):
     def add_task_id_option(self, help_text):
         """This method streamlines the addition of adding a task_id option to
         the command line parser.
         """
-        available_tasks = []
-        if self.task_graph:
-            available_tasks = self.task_graph.get_task_ids()
-        self.option_parser.add_argument(
+        action = self.option_parser.add_argument(
             'task_id',
             metavar='TASK_ID',
             type=str,
-            choices=available_tasks,
+            choices=TaskIdChoices(self),
             nargs='?',
             help=help_text,
         )
-        # TODO: using `nargs='*'` does not work with `choices`
-        # specified for some reason. For now, electing to use
-        # `choices` and nargs='?'` so that command line autocomplete
-        # works. Also tried to use `nargs=argcomplete.REMAINDER` and
-        # `action='append'` but neither of these options worked either.
+        action.completer = complete_task_ids
+
+    def add_task_ids_option(self, help_text):
+        """Add an option for any number of task ids (or wildcard patterns of
+        task ids) to the command line parser.
+        """
+        # argparse checks the empty list against `choices` when no
+        # task ids are specified with `nargs='*'`, so the task ids are
+        # validated by the task graph instead (TaskGraph.find_tasks)
+        action = self.option_parser.add_argument(
+            'task_ids',
+            metavar='TASK_ID',
+            type=str,
+            nargs='*',
+            help=help_text,
+        )
+        action.completer = complete_task_ids
@@ -0,0 +1,61 @@
+import os
+import sys
+
+from .. import colors
+from .. import logger
+from ..exceptions import CommandLineException
+from .base import BaseCommand, TaskIdMixin
+
+
+class Command(BaseCommand, TaskIdMixin):
+    help_text = (
+        "Show the output of a task from one of the last runs of the "
+        "workflow (by default, the most recent run of that task)."
+    )
+
+    def execute(self, task_id=None, run=1):
+        try:
+            run_path, segments = self.find_task_segments(task_id, run)
+        except CommandLineException, e:
+            print(e)
+            sys.exit(1)
+
+        # output is written directly to stdout rather than logged to
+        # avoid storing it in the log of this invocation again
+        sys.stdout.write(colors.bold_white(
+            "%s in %s\n" % (task_id, os.path.basename(run_path))
+        ))
+        for message in logger.iter_task_output(run_path, segments):
+            sys.stdout.write(message)
+
+    def find_task_segments(self, task_id, run):
+        """Find the segments of the log of the `run`'th most recent run of
+        `task_id` in the logs of the last runs of the workflow
+        """
+        if task_id is None:
+            raise CommandLineException("specify a TASK_ID")
+        run_paths = logger.get_run_log_paths(self.task_graph.abs_logs_dir)
+        n_runs = 0
+        for run_path in reversed(run_paths):
+            segments = logger.get_task_segments(run_path, task_id)
+            if segments:
+                n_runs += 1
+                if n_runs == run:
+                    return run_path, segments
+        raise CommandLineException(
+            "%s ran %d times in the last %d runs of the workflow" % (
+                task_id, n_runs, len(run_paths),
+            )
+        )
+
+    def add_command_line_options(self):
+        self.add_task_id_option('Specify the task to show the output of.')
+        self.option_parser.add_argument(
+            '-r', '--run',
+            type=int,
+            default=1,
+            help=(
+                "Show the output of the RUN'th most recent run of the "
+                "task (default: 1)."
+            ),
+        )
@@ -2,40 +2,43 @@ import os
 import sys
 
 from ..exceptions import ShellError, CommandLineException
-from ..notify import notify
 from .base import BaseCommand, TaskIdMixin
 
 
 class Command(BaseCommand, TaskIdMixin):
     help_text = "Run the task workflow."
 
-    def inner_execute(self, task_id, force, dry_run):
+    def inner_execute(self, task_ids, force, dry_run, jobs):
 
         # restrict task graph as necessary for the purposes of running
-        # the workflow
-        if task_id is not None:
-            self.task_graph = self.task_graph.subgraph_needed_for([task_id])
+        # the workflow. the tasks needed for all of the task_ids are
+        # run together so that shared upstream tasks are only checked
+        # once
+        if task_ids:
+            self.task_graph = self.task_graph.subgraph_needed_for(task_ids)
 
         # when the workflow is --force'd, this runs all
         # tasks. Otherwise, only runs tasks that are out of sync.
         if force:
-            self.task_graph.run_all(mock_run=dry_run)
+            self.task_graph.run_all(mock_run=dry_run, jobs=jobs)
         else:
-            self.task_graph.run_all_out_of_sync(mock_run=dry_run)
+            self.task_graph.run_all_out_of_sync(mock_run=dry_run, jobs=jobs)
 
         # mark the self.task_graph as completing successfully to send the
         # correct email message
         self.task_graph.successful = True
 
-    def execute(self, task_id=None, force=False, dry_run=False,
+    def execute(self, task_ids=None, force=False, dry_run=False, jobs=1,
                 notify_emails=None):
         try:
-            self.inner_execute(task_id, force, dry_run)
+            self.inner_execute(task_ids, force, dry_run, jobs)
         except CommandLineException, e:
             print(e)
             sys.exit(getattr(e, 'exit_code', 1))
         finally:
             if notify_emails:
+                # sending email is rare and importing smtplib is slow
+                from ..notify import notify
                 notify(*notify_emails)
 
     def add_command_line_options(self):
@@ -55,6 +58,16 @@ class Command(BaseCommand, TaskIdMixin):
                 "and how long it would take."
             ),
         )
+        self.option_parser.add_argument(
+            '-j', '--jobs',
+            type=int,
+            default=1,
+            metavar='N',
+            help=(
+                "Run up to N tasks at the same time. Tasks are started as "
+                "soon as all of the tasks they depend on have finished."
+            ),
+        )
         self.option_parser.add_argument(
             '--notify',
             type=str,
@@ -63,4 +76,7 @@ class Command(BaseCommand, TaskIdMixin):
             nargs=1,
             help='Specify an email address to notify on completion.',
         )
-        self.add_task_id_option('Specify a particular task to run.')
+        self.add_task_ids_option(
+            'Specify particular tasks to run, either by their ids or by '
+            'wildcard patterns like "data/per_file/*".'
+        )
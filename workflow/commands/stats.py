@@ -0,0 +1,78 @@
+from .. import colors
+from .base import BaseCommand, TaskIdMixin
+
+
+class Command(BaseCommand, TaskIdMixin):
+    help_text = (
+        "Show how long tasks take over time. If a `task_id` is specified, "
+        "show every recorded run of that task."
+    )
+
+    # a task is flagged as regressing when its most recent run takes
+    # this many times longer than the median of its previous runs
+    regression_factor = 1.5
+
+    def execute(self, task_id=None):
+        if task_id is None:
+            self.task_summary()
+        else:
+            self.task_runs(task_id)
+
+    def task_summary(self):
+        """Summarize the duration of every task, slowest tasks first"""
+        history = self.task_graph.history
+        rows = []
+        for task_id in history.get_task_ids():
+            if history.get_durations(task_id):
+                rows.append((history.get_percentile(task_id, 50), task_id))
+        rows.sort(reverse=True)
+
+        logger = self.task_graph.logger
+        logger.info(colors.bold_white("%-44s%5s%10s%10s%10s" % (
+            "TASK", "RUNS", "p50", "p95", "max",
+        )))
+        for p50, task_id in rows:
+            msg = "%-44s%5d%10s%10s%10s" % (
+                task_id,
+                len(history.get_durations(task_id)),
+                self.task_graph.duration_string(p50),
+                self.task_graph.duration_string(
+                    history.get_percentile(task_id, 95)
+                ),
+                self.task_graph.duration_string(
+                    history.get_percentile(task_id, 100)
+                ),
+            )
+            if self.is_regressing(task_id):
+                msg = colors.red(msg + "  (regressing)")
+            logger.info(msg)
+
+    def is_regressing(self, task_id):
+        durations = self.task_graph.history.get_durations(task_id)
+        if len(durations) < 3:
+            return False
+        median = sorted(durations[:-1])[(len(durations) - 1) // 2]
+        return durations[-1] > self.regression_factor * median
+
+    def task_runs(self, task_id):
+        """List every recorded run of task_id, oldest first"""
+        logger = self.task_graph.logger
+        logger.info(colors.bold_white("%-21s%10s%6s%12s  %s" % (
+            "TIMESTAMP", "DURATION", "EXIT", "INPUT SIZE", "HOST",
+        )))
+        for run in self.task_graph.history.get_runs(task_id):
+            msg = "%-21s%10s%6d%12d  %s" % (
+                run.timestamp,
+                self.task_graph.duration_string(run.duration),
+                run.exit_code,
+                run.input_size,
+                run.host,
+            )
+            if run.exit_code != 0:
+                msg = colors.red(msg)
+            logger.info(msg)
+
+    def add_command_line_options(self):
+        self.add_task_id_option(
+            'Specify a particular task to show all of its recorded runs.'
+        )
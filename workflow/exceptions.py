@@ -21,6 +21,28 @@ class InvalidTaskDefinition(CommandLineException):
     pass
 
 
+class DependencyCycle(InvalidTaskDefinition):
+    def __init__(self, task_ids):
+        self.task_ids = task_ids
+
+    def __str__(self):
+        return "Tasks depend on each other in a cycle:\n%s" % (
+            ' -> '.join(self.task_ids),
+        )
+
+
+class UnknownHashAlgorithm(CommandLineException):
+    def __init__(self, algorithm, available_algorithms):
+        self.algorithm = algorithm
+        self.available_algorithms = available_algorithms
+
+    def __str__(self):
+        return "Unknown hash algorithm '%s'. Choose one of: %s" % (
+            self.algorithm,
+            ', '.join(self.available_algorithms),
+        )
+
+
 class ResourceNotFound(CommandLineException):
     def __init__(self, resource):
         self.resource = resource
@@ -29,6 +51,14 @@ class ResourceNotFound(CommandLineException):
         return "\nResource '%s' not found" % self.resource
 
 
+class TaskNotFound(CommandLineException):
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    def __str__(self):
+        return "No task matches '%s'" % self.pattern
+
+
 class NonUniqueTask(CommandLineException):
     pass
 
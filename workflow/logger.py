@@ -3,23 +3,193 @@ file, which can be convenient for inspecting long-running jobs and for
 sending notifications with useful content
 """
 
+import os
+import glob
+import time
 import logging
+import logging.handlers
 import sys
 
 from .colors import colorless
 
+# the log file is rotated to a single backup file (workflow.log.1) when
+# it grows larger than the `max_log_size` setting (in megabytes)
+DEFAULT_MAX_LOG_SIZE = 100
+
+# the output of every task is also stored in a log of every run, which
+# are kept for the last `log_runs` runs, as long as all of them
+# together are no larger than `max_log_size` (see TaskLogHandler)
+DEFAULT_LOG_RUNS = 10
+
 # _logger is a singleton instance of the logger that is a local cache
 # of the one and only logger instance for all TaskGraphs. This is
 # necessary in the event that a subgraph is selected.
 _logger = None
 
 
-class ColorlessFileHandler(logging.FileHandler):
+class ColorlessFileHandler(logging.handlers.RotatingFileHandler):
     def emit(self, record):
         record.msg = colorless(record.msg)
         return super(ColorlessFileHandler, self).emit(record)
 
 
+class TaskLogHandler(logging.Handler):
+    """Store the messages that are logged with the `task_ids` they belong
+    to (with `extra={'task_ids': [...]}`) in a log of this run in
+    `logs_dir`, next to an index of the byte offset and length of every
+    message for every task. The output of one task can be read from
+    this log without reading the output of the tasks that ran at the
+    same time (see get_task_segments).
+
+    The logs of the last `n_runs` runs are kept, but the logs of old
+    runs are removed sooner when all of them together would grow
+    larger than `max_bytes`. Once the log of this run alone is that
+    large, the rest of the output of its tasks is truncated.
+    """
+
+    truncated_message = "... (the output was truncated at max_log_size)\n"
+
+    def __init__(self, logs_dir, n_runs, max_bytes):
+        super(TaskLogHandler, self).__init__()
+        self.logs_dir = logs_dir
+        self.n_runs = n_runs
+        self.max_bytes = max_bytes
+        self.stream = None
+        self.index_stream = None
+        self.old_runs = []
+        self.truncated_task_ids = set()
+
+    def open(self):
+        """Open the log of this run the first time a task logs a message
+        and remove the logs of runs that are no longer kept
+        """
+        if not os.path.exists(self.logs_dir):
+            os.makedirs(self.logs_dir)
+        self.old_runs = [
+            (run_path, get_run_log_size(run_path))
+            for run_path in get_run_log_paths(self.logs_dir)
+        ]
+        while len(self.old_runs) >= max(self.n_runs, 1):
+            self.remove_oldest_run()
+        run_name = "%s.%d" % (time.strftime("%Y-%m-%dT%H-%M-%S"), os.getpid())
+        run_path = os.path.join(self.logs_dir, run_name)
+        self.stream = open(run_path + '.log', 'ab')
+        self.index_stream = open(run_path + '.index', 'ab')
+
+    def remove_oldest_run(self):
+        run_path, size = self.old_runs.pop(0)
+        os.remove(run_path + '.log')
+        os.remove(run_path + '.index')
+
+    def has_room_for(self, size):
+        """Check whether `size` more bytes fit in the logs of the runs,
+        removing the logs of old runs to make room if necessary
+        """
+        size += self.stream.tell()
+        while self.old_runs and \
+                size + sum(s for r, s in self.old_runs) > self.max_bytes:
+            self.remove_oldest_run()
+        return size <= self.max_bytes
+
+    def emit(self, record):
+        task_ids = set(getattr(record, 'task_ids', None) or [])
+        task_ids.difference_update(self.truncated_task_ids)
+        if not task_ids:
+            return
+        try:
+            if self.stream is None:
+                self.open()
+            message = colorless(self.format(record)) + '\n'
+            if self.has_room_for(len(message)):
+                self.write(message, task_ids)
+            else:
+                self.truncated_task_ids.update(task_ids)
+                self.write(self.truncated_message, task_ids)
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+
+    def write(self, message, task_ids):
+        """Append `message` to the log and index it for every task"""
+        if isinstance(message, unicode):
+            message = message.encode('utf-8')
+        offset = self.stream.tell()
+        self.stream.write(message)
+        self.stream.flush()
+        for task_id in task_ids:
+            self.index_stream.write((u'%s\t%d\t%d\n' % (
+                task_id, offset, len(message),
+            )).encode('utf-8'))
+        self.index_stream.flush()
+
+    def close(self):
+        for stream in (self.stream, self.index_stream):
+            if stream is not None:
+                stream.close()
+        super(TaskLogHandler, self).close()
+
+
+def get_run_log_paths(logs_dir):
+    """Get the paths (without the .log and .index extensions) of the logs
+    of every run in `logs_dir`, oldest first
+    """
+    run_paths = glob.glob(os.path.join(logs_dir, '*.index'))
+    run_paths = [run_path[:-len('.index')] for run_path in run_paths]
+    return sorted(run_paths, key=lambda run_path: os.path.getmtime(
+        run_path + '.index'
+    ))
+
+
+def get_run_log_size(run_path):
+    return sum(
+        os.path.getsize(run_path + extension)
+        for extension in ('.log', '.index')
+    )
+
+
+def get_task_segments(run_path, task_id):
+    """Get the byte offset and length of every message that `task_id`
+    logged in the run that is stored at `run_path`
+    """
+    segments = []
+    with open(run_path + '.index', 'rb') as index_stream:
+        for line in index_stream:
+            segment_task_id, offset, length = line.rsplit('\t', 2)
+            if segment_task_id == task_id:
+                segments.append((int(offset), int(length)))
+    return segments
+
+
+def iter_task_output(run_path, segments):
+    """Iterate over the messages in the log of the run that is stored at
+    `run_path` by seeking to each one of the `segments`
+    """
+    with open(run_path + '.log', 'rb') as stream:
+        for offset, length in segments:
+            stream.seek(offset)
+            yield stream.read(length)
+
+
+def tail(path, n_lines, block_size=2**16):
+    """Get the last `n_lines` lines of the file located at `path` by
+    reading blocks backwards from the end of the file, so that only
+    the end of a (potentially huge) file is ever read into memory.
+    """
+    if n_lines <= 0 or not os.path.exists(path):
+        return []
+    with open(path, 'rb') as stream:
+        stream.seek(0, os.SEEK_END)
+        position = stream.tell()
+        data = ''
+        while position > 0 and data.count('\n') <= n_lines:
+            size = min(block_size, position)
+            position -= size
+            stream.seek(position)
+            data = stream.read(size) + data
+    return data.splitlines()[-n_lines:]
+
+
 def configure(task_graph):
     global _logger
     if _logger is not None:
@@ -30,19 +200,30 @@ def configure(task_graph):
 
     # create file handler and a console handler that logs to stdout
     console_handler = logging.StreamHandler(sys.stdout)
-    file_handler = ColorlessFileHandler(task_graph.abs_log_path, mode='w')
+    # every run starts with an empty log file (and no backups from
+    # previous runs) whose size is capped by rotating it
+    for path in glob.glob(task_graph.abs_log_path + '*'):
+        os.remove(path)
+    max_log_size = task_graph.settings.get(
+        'max_log_size', DEFAULT_MAX_LOG_SIZE,
+    )
+    max_bytes = int(max_log_size * 2**20)
+    file_handler = ColorlessFileHandler(
+        task_graph.abs_log_path, maxBytes=max_bytes, backupCount=1,
+    )
 
-    # set the logging levels on these handlers
-    console_handler.setLevel(logging.DEBUG)
-    file_handler.setLevel(logging.DEBUG)
+    task_log_handler = TaskLogHandler(
+        task_graph.abs_logs_dir,
+        task_graph.settings.get('log_runs', DEFAULT_LOG_RUNS),
+        max_bytes,
+    )
 
-    # create formatter and add it to the handlers
+    # set the logging levels on these handlers, create formatter and
+    # add it to the handlers and add the handlers to logger
     formatter = logging.Formatter('%(message)s')
-    console_handler.setFormatter(formatter)
-    file_handler.setFormatter(formatter)
-
-    # add the handlers to logger
-    logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
+    for handler in (console_handler, file_handler, task_log_handler):
+        handler.setLevel(logging.DEBUG)
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
 
     return logger
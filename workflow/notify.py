@@ -3,6 +3,7 @@ from email.mime.text import MIMEText
 import socket
 
 from .parser import load_task_graph
+from .logger import tail
 
 
 def notify(*contact_list):
@@ -19,15 +20,16 @@ def notify(*contact_list):
     if task_graph.successful:
         status = 'successfully finished'
 
-    # read in the logs for the body of the message
-    # TODO: this reads the ENTIRE log into memory. likely not a good idea.
+    # read in the end of the logs for the body of the message. if the
+    # log was just rotated, the beginning comes from its backup
     n_lines = 100
-    with open(task_graph.abs_log_path, 'r') as stream:
-        text = "the last %d lines of %s\n\n" % (
-            n_lines, task_graph.abs_log_path
-        )
-        text += '"'*80 + "\n\n"
-        text += '\n'.join(stream.readlines()[-100:])
+    lines = tail(task_graph.abs_log_path, n_lines)
+    lines = tail(task_graph.abs_log_path + '.1', n_lines - len(lines)) + lines
+    text = "the last %d lines of %s\n\n" % (
+        n_lines, task_graph.abs_log_path
+    )
+    text += '"'*80 + "\n\n"
+    text += '\n'.join(lines)
 
     # fill out the relevant header information
     msg = MIMEText(text)
@@ -7,16 +7,26 @@ provides a singleton instance of the TaskGraph (often called
 
 import os
 import copy
-
-import yaml
+import hashlib
+import cPickle
 
 from . import exceptions
-from . import tasks
+from . import storage
+from . import VERSION
+
+# yaml and the tasks subpackage (which imports jinja2) are only
+# imported when the task graph is loaded, because importing them is
+# much slower than the rest of the command line interface
 
 # TODO: probably this should be configurable (and even specified on
 # the command line somehow)
 CONFIG_FILENAME = "workflow.yaml"
 TASKS_KEY = 'tasks'
+SETTINGS_KEY = 'settings'
+
+# index of all task ids, relative to the workflow.yaml, that is used to
+# complete task ids on the command line without loading the task graph
+TASK_IDS_PATH = os.path.join(".workflow", "task_ids.txt")
 
 # this is a global cache of the workflow task_graph object so we
 # aren't creating a bunch of these when we run the workflow
@@ -44,6 +54,17 @@ def find_config_path():
     return config_path
 
 
+def config_yaml2settings(config_yaml):
+    """extract the workflow settings from the config_yaml list. settings
+    are specified with the SETTINGS_KEY in the first YAML object and
+    they are removed from that object so that they are not treated as
+    templating variables (or as a task).
+    """
+    if config_yaml and SETTINGS_KEY in config_yaml[0]:
+        return config_yaml[0].pop(SETTINGS_KEY) or {}
+    return {}
+
+
 def config_yaml2task_kwargs_list(config_yaml):
     """convert the config_yaml iterator into python dictionaries as
     necessary. this makes it possible to have global variables and
@@ -62,11 +83,106 @@ def config_yaml2task_kwargs_list(config_yaml):
             for task_data in yaml_obj[TASKS_KEY]:
                 task_data.update(global_config)
                 task_kwargs_list.append(task_data)
-        elif not uses_global_config:
+        elif not uses_global_config and yaml_obj:
             task_kwargs_list.append(yaml_obj)
     return task_kwargs_list
 
 
+def get_listing_key(root_directory, directories):
+    """Hash the names of all of the files in `directories`, which changes
+    whenever files are added to or removed from any of them
+    """
+    listing_hash = hashlib.sha1()
+    for directory in directories:
+        path = os.path.join(root_directory, directory)
+        names = sorted(os.listdir(path)) if os.path.isdir(path) else []
+        listing_hash.update('%s\n%s\n' % (directory, '\n'.join(names)))
+    return listing_hash.hexdigest()
+
+
+def load_compiled_graph(compiled_path, config_key):
+    """Load the settings and compiled tasks of a task graph that was
+    stored by save_compiled_graph. Returns None if nothing was stored
+    for this `config_key` or if the files that match the patterns of
+    pattern tasks have changed since.
+    """
+    try:
+        with open(compiled_path, 'rb') as stream:
+            compiled_key, listing_key, settings, compiled = \
+                cPickle.load(stream)
+    except Exception:
+        # a missing, corrupt or incompatible cache is rebuilt from the
+        # workflow.yaml
+        return None
+    root_directory = os.path.dirname(os.path.dirname(compiled_path))
+    directories = compiled['pattern_directories']
+    if compiled_key != config_key or \
+            listing_key != get_listing_key(root_directory, directories):
+        return None
+    return settings, compiled
+
+
+def save_compiled_graph(task_graph, config_key):
+    """Store the task graph so that it can be loaded without parsing the
+    YAML or rendering any templates until the workflow.yaml changes
+    """
+    listing_key = get_listing_key(
+        task_graph.root_directory, task_graph.pattern_directories,
+    )
+    data = (config_key, listing_key, task_graph.settings, task_graph.compile())
+    storage.write_file(
+        cPickle.dumps(data, cPickle.HIGHEST_PROTOCOL),
+        task_graph.abs_compiled_path,
+    )
+
+
+def read_config():
+    """Find the configuration file and read its contents"""
+    config_path = find_config_path()
+    with open(config_path) as stream:
+        config_contents = stream.read()
+    return config_path, config_contents
+
+
+def save_task_ids(task_graph, config_contents):
+    """Store the ids of all tasks in an index next to the hash of the
+    configuration and the pattern directories they were loaded from
+    """
+    directories = task_graph.pattern_directories
+    header = [
+        hashlib.sha1(config_contents).hexdigest(),
+        get_listing_key(task_graph.root_directory, directories),
+        '\t'.join(directories),
+    ]
+    storage.write_file(
+        '\n'.join(header + task_graph.get_task_ids()) + '\n',
+        os.path.join(task_graph.root_directory, TASK_IDS_PATH),
+    )
+
+
+def load_task_ids():
+    """Quickly load the ids of all tasks from the index stored by
+    save_task_ids. The task graph is only loaded when the index does
+    not exist or when the configuration (or the files that match the
+    patterns of pattern tasks) has changed since.
+    """
+    config_path, config_contents = read_config()
+    root_directory = os.path.dirname(config_path)
+    task_ids_path = os.path.join(root_directory, TASK_IDS_PATH)
+    if os.path.exists(task_ids_path):
+        with open(task_ids_path) as stream:
+            lines = stream.read().splitlines()
+        if len(lines) >= 3 and \
+                lines[0] == hashlib.sha1(config_contents).hexdigest() and \
+                lines[1] == get_listing_key(
+                    root_directory, filter(None, lines[2].split('\t')),
+                ):
+            return lines[3:]
+    task_graph = load_task_graph()
+    save_task_ids(task_graph, config_contents)
+    return task_graph.get_task_ids()
+
+
 def load_task_graph():
     """Load the task graph from the configuration file located at
     config_path
@@ -74,16 +190,35 @@ def load_task_graph():
     global _task_graph
     if _task_graph is not None:
         return _task_graph
+    import yaml
+    from . import tasks
 
     # get workflow configuration file
-    config_path = find_config_path()
+    config_path, config_contents = read_config()
+
+    # reuse the compiled task graph from a previous invocation if
+    # neither the workflow.yaml nor the way tasks are compiled have
+    # changed
+    config_key = hashlib.sha1('%s %s\n%s' % (
+        VERSION, tasks.Task.compiled_attributes, config_contents,
+    )).hexdigest()
+    compiled_path = os.path.join(
+        os.path.dirname(config_path), tasks.TaskGraph.compiled_path,
+    )
+    compiled = load_compiled_graph(compiled_path, config_key)
+    if compiled is not None:
+        settings, compiled = compiled
+        _task_graph = tasks.TaskGraph(config_path, None, settings, compiled)
+        return _task_graph
 
     # load the data
-    with open(config_path) as stream:
-        config_yaml = yaml.load_all(stream.read())
+    config_yaml = list(yaml.load_all(config_contents))
+    settings = config_yaml2settings(config_yaml)
     task_kwargs_list = config_yaml2task_kwargs_list(config_yaml)
 
     # convert each task_kwargs into a Task object and add it to the
     # TaskGraph
-    _task_graph = tasks.TaskGraph(config_path, task_kwargs_list)
+    _task_graph = tasks.TaskGraph(config_path, task_kwargs_list, settings)
+    save_compiled_graph(_task_graph, config_key)
+    save_task_ids(_task_graph, config_contents)
     return _task_graph
@@ -1,11 +1,13 @@
 from . import base
 from .file_system import FileSystem
+from .cache import StateCache, DirectoryListings
+from .hashing import HashPool
 
 
-def get_or_create(graph, candidate_list):
+def get_or_create(graph, candidate_list, register=True):
     """This is a factory function that instantiates resources from a
     candidate_list. Each candidate in the candidate_list must be a
-    string.
+    string. New resources are only added to the graph if `register`.
     """
     resources = []
     for candidate in candidate_list:
@@ -16,6 +18,6 @@ def get_or_create(graph, candidate_list):
             try:
                 resource = graph.resource_dict[candidate]
             except KeyError:
-                resource = FileSystem(graph, candidate)
+                resource = FileSystem(graph, candidate, register=register)
             resources.append(resource)
     return resources
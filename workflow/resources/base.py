@@ -1,7 +1,7 @@
 """Base resource here
 """
 
-import hashlib
+from . import hashing
 
 
 class BaseResource(object):
@@ -13,12 +13,15 @@ class BaseResource(object):
     resource and whether it is in sync.
     """
 
-    def __init__(self, graph, name):
+    def __init__(self, graph, name, register=True):
         self.graph = graph
         self.name = name
 
         # add this resource to the graph's resource_dict, which globally
         # stores all of the resources associated with this workflow
+        # (unless it is only used temporarily, like to archive files)
+        if not register:
+            return
         if name in self.graph.resource_dict:
             raise ValueError(
                 "Resource '%s' already exists in this graph" % name
@@ -34,22 +37,21 @@ class BaseResource(object):
         every task"""
         return self.graph.root_directory
 
-    def get_stream_state(self, stream, block_size=2**20):
+    def get_stream_state(self, stream, block_size=2**20, algorithm=None):
         """Read in a stream in relatively small `block_size`s to make sure we
         won't have memory problems on BIG DATA streams.
-        http://stackoverflow.com/a/1131255/564709
+        http://stackoverflow.com/a/1131255/564709. The stream is hashed
+        with `algorithm`, which defaults to the hash algorithm of the
+        workflow.
         """
-        # TODO: this is called relatively frquently and is almost
-        # certainly IO bound. think about optimizing for speed if
-        # necessary by possibly reading random chunks of a stream
-        # instead of the whole darn thing
-        state = hashlib.sha1()
-        while True:
-            data = stream.read(block_size)
-            if not data:
-                break
-            state.update(data)
-        return state.hexdigest()
+        # this is called relatively frequently and is almost certainly
+        # IO bound. very large files can be sampled instead of being
+        # read in their entirety with the `sampled_hash` setting (see
+        # FileSystem.sampled_state)
+        algorithm = algorithm or self.graph.hash_algorithm
+        state = hashing.new_hash(algorithm)
+        hashing.update_from_stream(state, stream, block_size)
+        return hashing.format_state(algorithm, state.hexdigest())
 
     def get_previous_state(self):
         """Get the previous state of this resource prior to this run. If the
@@ -57,27 +59,57 @@ class BaseResource(object):
         """
         return self.graph.get_state_from_storage(self.name)
 
-    def get_current_state(self):
-        """Get the current state of this resource. If the resource does
-        not exist, throw an error.
+    def get_current_state(self, algorithm=None):
+        """Get the current state of this resource, hashed with `algorithm`
+        (or the hash algorithm of the workflow if it is not
+        specified). If the resource does not exist, throw an error.
 
-        This method must be overwritten by any child classes.
-
-        TODO: need to figure out a way to avoid running this method
-        multiple times on the same resource during a single workflow
-        run. this is more of a performance issue that can be revisited
-        later as it becomes an issue. can maybe cache somehow?
+        This method must be overwritten by any child classes. To avoid
+        computing the state of the same resource several times during
+        a single workflow run, use get_cached_state instead.
         """
         raise NotImplementedError(
             "Must implement current_state for child classes"
         )
 
+    def get_cached_state(self):
+        """Get the current state of this resource, computing it at most once
+        per workflow run. The cached state is invalidated by the graph
+        whenever a task (re)creates this resource.
+        """
+        return self.graph.state_cache.get(self)
+
+    def is_composite(self):
+        """Composite resources, like directories, are made of many parts
+        that are hashed concurrently when computing their state.
+        """
+        return False
+
     def state_in_sync(self):
         """Check the stored state of this resource compared with the current
         state of this resource. If they are the same, then this resource
         is in_sync.
         """
-        return self.get_previous_state() == self.get_current_state()
+        previous_state = self.get_previous_state()
+
+        # if the hash algorithm of the workflow has changed since the
+        # state was stored, compare it with a state computed by the old
+        # algorithm instead of re-running everything. the state is
+        # stored with the new algorithm at the end of this run.
+        algorithm = hashing.get_state_algorithm(previous_state)
+        if previous_state and algorithm != self.graph.hash_algorithm:
+            if algorithm not in hashing.ALGORITHMS:
+                return False
+            return previous_state == self.get_current_state(algorithm)
+        return previous_state == self.get_cached_state()
+
+    def get_size(self):
+        """Get the size of this resource in bytes. This method must be
+        overwritten by any child classes.
+        """
+        raise NotImplementedError(
+            "Must implement get_size for child classes"
+        )
 
     def get_filename(self):
         """This gets a filename for a (possibly temporary) storage location
@@ -0,0 +1,136 @@
+"""Per-run cache of the current state of resources. Computing the state
+of a resource usually means hashing a (potentially very large) file or
+directory, so this makes sure that every resource is hashed at most
+once during a workflow run.
+"""
+
+import os
+
+
+def _iter_parent_names(name):
+    """Iterate over the names of all of the directories that contain
+    resource `name`, with and without a trailing slash, as they might
+    be declared in a workflow.yaml.
+    """
+    directory = os.path.dirname(os.path.normpath(name))
+    while directory:
+        yield directory
+        yield directory + os.path.sep
+        directory = os.path.dirname(directory)
+
+
+class StateCache(object):
+    """Store the current state of resources, keyed by resource name, the
+    first time that it is requested.
+    """
+
+    def __init__(self):
+        self.states = {}
+
+        # (state, stat fingerprint) of every file that was hashed
+        # during this run when the `stat_fingerprint` setting is
+        # enabled. These are stored alongside the resource states.
+        self.fingerprints = {}
+
+        # Merkle tree hashes of every directory that was hashed during
+        # this run, keyed by its path relative to the workflow root
+        self.directory_states = {}
+
+        # sizes of resources, keyed by resource name, which are recorded
+        # in the history of every task that depends on them
+        self.sizes = {}
+
+    def get(self, resource):
+        try:
+            return self.states[resource.name]
+        except KeyError:
+            state = resource.get_current_state()
+            self.states[resource.name] = state
+            return state
+
+    def get_size(self, resource):
+        try:
+            return self.sizes[resource.name]
+        except KeyError:
+            size = resource.get_size()
+            self.sizes[resource.name] = size
+            return size
+
+    def prefetch(self, resources, hash_pool):
+        """Compute the states of all `resources` that are not cached yet
+        using the threads in `hash_pool`. Composite resources (like
+        directories) hash their parts concurrently themselves, so they
+        are computed one at a time.
+        """
+        pending = set(r for r in resources if r.name not in self.states)
+        composites = [r for r in pending if r.is_composite()]
+        hash_pool.map(self.get, pending.difference(composites))
+        for resource in composites:
+            self.get(resource)
+
+    def invalidate(self, resources):
+        """Forget the cached state of `resources` (typically the resources
+        that a task just created) and of any directory that contains
+        them so that they are hashed again the next time they are
+        needed.
+        """
+        for resource in resources:
+            self.states.pop(resource.name, None)
+            self.sizes.pop(resource.name, None)
+            for name in _iter_parent_names(resource.name):
+                self.states.pop(name, None)
+                self.directory_states.pop(name, None)
+                self.sizes.pop(name, None)
+
+            # a created directory invalidates all of its subdirectories
+            name = os.path.normpath(resource.name)
+            for directory in self.directory_states.keys():
+                if directory == name or directory.startswith(name + os.sep):
+                    del self.directory_states[directory]
+
+            # ... and the sizes of everything in it
+            if resource.is_composite():
+                for size_name in self.sizes.keys():
+                    if os.path.normpath(size_name).startswith(name + os.sep):
+                        del self.sizes[size_name]
+
+    def clear(self):
+        self.states.clear()
+        self.fingerprints.clear()
+        self.directory_states.clear()
+        self.sizes.clear()
+
+
+class DirectoryListings(object):
+    """Snapshot of the contents of directories that is used to check
+    whether many files exist with a single os.listdir per directory
+    rather than a system call per file.
+    """
+
+    def __init__(self):
+        self.listings = {}
+
+    def listdir(self, directory):
+        """Get the set of names in `directory`, which is empty if the
+        directory does not exist
+        """
+        directory = os.path.normpath(directory)
+        if directory not in self.listings:
+            try:
+                self.listings[directory] = frozenset(os.listdir(directory))
+            except OSError:
+                self.listings[directory] = frozenset()
+        return self.listings[directory]
+
+    def exists(self, path):
+        directory, name = os.path.split(os.path.normpath(path))
+        if name in self.listdir(directory):
+            return True
+
+        # names that are not listed are double checked because names
+        # are not necessarily listed the same way they are referred to
+        # (e.g. on case-insensitive file systems)
+        return os.path.exists(path)
+
+    def clear(self):
+        self.listings.clear()
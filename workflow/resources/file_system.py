@@ -1,7 +1,39 @@
 import os
-import hashlib
+import io
+import fnmatch
+import mmap
 
 from .base import BaseResource
+from . import hashing
+
+# read-only views of memory-mapped files that are hashed without
+# copying the data into python strings
+try:
+    _view = buffer
+except NameError:
+    def _view(data, offset, size):
+        return memoryview(data)[offset:offset + size]
+
+
+def sample_offsets(size, block_size, n_blocks):
+    """Offsets of the head, the tail and `n_blocks` evenly spaced blocks in
+    between them of a file that is `size` bytes long
+    """
+    last = size - block_size
+    offsets = [0]
+    for i in range(1, n_blocks + 1):
+        offsets.append(last * i // (n_blocks + 1))
+    offsets.append(last)
+    return offsets
+
+
+def stat_fingerprint(path):
+    """Fingerprint of a file from its size, modification time (in
+    nanoseconds) and inode that changes whenever the file is modified,
+    replaced or touched.
+    """
+    stat = os.stat(path)
+    return (stat.st_size, int(stat.st_mtime * 10**9), stat.st_ino)
 
 
 class FileSystem(BaseResource):
@@ -14,26 +46,180 @@ class FileSystem(BaseResource):
             os.path.join(self.root_directory, self.name)
         )
 
-    def file_state(self, resource_path=None):
-        with open(resource_path or self.resource_path) as stream:
-            state = self.get_stream_state(stream)
+        # files and directories are walked and named by their paths
+        # relative to the root of the workflow without resolving any
+        # symbolic links, so that their names match the names of the
+        # resources in the StateCache
+        self.path = os.path.normpath(
+            os.path.join(self.root_directory, self.name)
+        )
+
+    def file_state(self, resource_path=None, algorithm=None):
+        """Hash the contents of the file located at `resource_path`. When the
+        `stat_fingerprint` setting is enabled, the stored hash is reused
+        for any file whose stat fingerprint has not changed since it
+        was last hashed with the same algorithm.
+        """
+        resource_path = resource_path or self.path
+        algorithm = algorithm or self.graph.hash_algorithm
+        if not self.graph.settings.get('stat_fingerprint'):
+            return self.hash_file(resource_path, algorithm)
+
+        # fingerprints are stored under a 'file:' namespace (much like
+        # tasks are stored under 'config:') so that they never clobber
+        # the stored state of a resource with the same name
+        name = 'file:' + self.relative_name(resource_path)
+        stat = stat_fingerprint(resource_path)
+        state = self.graph.state_store.get(name)
+        stored_algorithm = hashing.get_state_algorithm(state)
+        if stored_algorithm != algorithm or \
+                self.graph.state_store.get_stat(name) != stat:
+            state = self.hash_file(resource_path, algorithm)
+        if algorithm == self.graph.hash_algorithm:
+            self.graph.state_cache.fingerprints[name] = (state, stat)
+        return state
+
+    def hash_file(self, resource_path, algorithm=None):
+        if self.is_sampled(resource_path):
+            state = self.sampled_state(resource_path, algorithm)
+            if state is not None:
+                return state
+        # unbuffered binary streams are read directly into the buffer
+        # that is hashed (see hashing.update_from_stream)
+        with io.open(resource_path, 'rb', buffering=0) as stream:
+            state = self.get_stream_state(stream, algorithm=algorithm)
         return state
 
-    def directory_state(self):
-        state_hash = hashlib.sha1()
-        for root, directories, filenames in os.walk(self.resource_path):
+    def content_state(self, resource_path=None, algorithm=None):
+        """Hash the entire contents of the file located at `resource_path`,
+        which identifies its contents in archives. Unlike file_state,
+        this never samples files that match the `sampled_hash` patterns.
+        """
+        resource_path = resource_path or self.path
+        if not self.is_sampled(resource_path):
+            return self.file_state(resource_path, algorithm)
+        with io.open(resource_path, 'rb', buffering=0) as stream:
+            return self.get_stream_state(stream, algorithm=algorithm)
+
+    def is_sampled(self, resource_path):
+        """Check whether the file at `resource_path` matches any of the
+        `sampled_hash` patterns in the settings
+        """
+        patterns = self.graph.settings.get('sampled_hash') or []
+        if isinstance(patterns, basestring):
+            patterns = [patterns]
+        name = self.relative_name(resource_path)
+        return any(fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+    def sampled_state(self, resource_path, algorithm=None, block_size=2**20):
+        """Hash the size, the head, the tail and `sampled_hash_blocks` evenly
+        spaced blocks of a (very large) file instead of its entire
+        contents. The blocks are read from a memory map of the file so
+        that only the sampled pages are ever read from disk. Files that
+        are too small to sample are not hashed here (returns None).
+        """
+        algorithm = algorithm or self.graph.hash_algorithm
+        n_blocks = self.graph.settings.get('sampled_hash_blocks', 16)
+        size = os.path.getsize(resource_path)
+        if size <= (n_blocks + 2) * block_size:
+            return None
+        state = hashing.new_hash(algorithm)
+        state.update("sampled %d %d %d\n" % (size, block_size, n_blocks))
+        with open(resource_path, 'rb') as stream:
+            data = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for offset in sample_offsets(size, block_size, n_blocks):
+                    state.update(_view(data, offset, block_size))
+            finally:
+                data.close()
+        return hashing.format_state(algorithm, state.hexdigest())
+
+    def relative_name(self, path):
+        """Name of `path` relative to the root of the workflow"""
+        return os.path.relpath(path, self.root_directory)
+
+    def walk(self, skip=()):
+        """Walk this directory like os.walk, but with all of the entries
+        sorted so that the order does not depend on the file system.
+        This does not descend into the subdirectories whose relative
+        names are in `skip`.
+        """
+        for root, directories, filenames in os.walk(self.path):
+            directories.sort()
+            filenames.sort()
+            yield root, list(directories), filenames
+            if skip:
+                directories[:] = [
+                    d for d in directories
+                    if self.relative_name(os.path.join(root, d)) not in skip
+                ]
+
+    def iter_filenames(self):
+        """Iterate over the absolute paths of all of the files in this
+        directory
+        """
+        for root, directories, filenames in self.walk():
             for filename in filenames:
-                abs_filename = os.path.join(root, filename)
-                state_hash.update(self.file_state(abs_filename))
-        return state_hash.hexdigest()
+                yield os.path.join(root, filename)
+
+    def directory_state(self, algorithm=None):
+        """Compute a Merkle tree hash of this directory. Every subdirectory
+        is hashed from the sorted names and states of its entries, so
+        the state of a directory is independent of the order of
+        os.walk and it changes whenever a file is renamed, added or
+        removed. The files are all hashed concurrently first and the
+        states of subdirectories are cached for the rest of the run.
+        """
+        algorithm = algorithm or self.graph.hash_algorithm
+        cached = {}
+        if algorithm == self.graph.hash_algorithm:
+            cached = self.graph.state_cache.directory_states
+        tree = list(self.walk(skip=cached))
+        filenames = [
+            os.path.join(root, filename)
+            for root, directories, filenames in tree for filename in filenames
+        ]
+        file_states = dict(zip(filenames, self.graph.hash_pool.map(
+            lambda filename: self.file_state(filename, algorithm), filenames,
+        )))
+
+        # subdirectories always come after their parents in `tree` so
+        # they are hashed first by iterating over it in reverse
+        for root, directories, filenames in reversed(tree):
+            entries = [
+                ('f', name, file_states[os.path.join(root, name)])
+                for name in filenames
+            ]
+            for name in directories:
+                path = os.path.join(root, name)
+                if os.path.islink(path):
+                    entries.append(('l', name, os.readlink(path)))
+                else:
+                    state = cached[self.relative_name(path)]
+                    entries.append(('d', name, state))
+            cached[self.relative_name(root)] = self.entries_state(
+                entries, algorithm,
+            )
+        return cached[self.relative_name(self.path)]
 
-    def get_current_state(self):
+    def entries_state(self, entries, algorithm=None):
+        """Hash the (type, name, state) of every entry in a directory"""
+        algorithm = algorithm or self.graph.hash_algorithm
+        state_hash = hashing.new_hash(algorithm)
+        for entry in sorted(entries, key=lambda entry: entry[1]):
+            state_hash.update("%s %s %s\n" % entry)
+        return hashing.format_state(algorithm, state_hash.hexdigest())
+
+    def is_composite(self):
+        return os.path.isdir(self.resource_path)
+
+    def get_current_state(self, algorithm=None):
         if not os.path.exists(self.resource_path):
             return None
         elif os.path.isfile(self.resource_path):
-            return self.file_state()
+            return self.file_state(algorithm=algorithm)
         elif os.path.isdir(self.resource_path):
-            return self.directory_state()
+            return self.directory_state(algorithm)
         else:
             raise NotImplementedError((
                 "file a feature request to support this type of "
@@ -41,5 +227,12 @@ class FileSystem(BaseResource):
                 "https://github.com/deanmalmgren/data-workflow/issues"
             ))
 
+    def get_size(self):
+        if os.path.isdir(self.resource_path):
+            return sum(map(os.path.getsize, self.iter_filenames()))
+        elif os.path.exists(self.resource_path):
+            return os.path.getsize(self.resource_path)
+        return 0
+
     def get_filename(self):
         return self.name
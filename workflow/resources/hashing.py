@@ -0,0 +1,127 @@
+"""Hash algorithms that can be used to compute the state of resources
+and concurrent hashing of many files at once. hashlib releases the GIL
+while it digests large blocks of data, so a pool of threads is enough
+to keep several cores (and disks) busy at the same time.
+"""
+
+import hashlib
+import multiprocessing
+import threading
+from multiprocessing.pool import ThreadPool
+
+from .. import exceptions
+
+# registry of the hash algorithms that can be selected with the `hash`
+# setting in a workflow.yaml. every value is a function that returns a
+# new hash object with the same interface as those in hashlib.
+ALGORITHMS = {
+    'md5': hashlib.md5,
+    'sha1': hashlib.sha1,
+    'sha256': hashlib.sha256,
+}
+DEFAULT_ALGORITHM = 'sha1'
+
+# blake2b is built into hashlib as of python 3.6 and is available from
+# the pyblake2 package before that
+try:
+    ALGORITHMS['blake2b'] = hashlib.blake2b
+except AttributeError:
+    try:
+        import pyblake2
+        ALGORITHMS['blake2b'] = pyblake2.blake2b
+    except ImportError:
+        pass
+
+# much faster, non-cryptographic hashes when the xxhash package is
+# installed
+try:
+    import xxhash
+    ALGORITHMS['xxh64'] = xxhash.xxh64
+except ImportError:
+    pass
+
+
+def register(name, factory):
+    """Make the hash algorithm returned by `factory` available as `name`"""
+    ALGORITHMS[name] = factory
+
+
+def new_hash(algorithm):
+    try:
+        return ALGORITHMS[algorithm]()
+    except KeyError:
+        raise exceptions.UnknownHashAlgorithm(algorithm, sorted(ALGORITHMS))
+
+
+def update_from_stream(state, stream, block_size=2**20):
+    """Update the hash object `state` with the entire contents of
+    `stream`. Streams that support readinto (like files opened with
+    io.open) are read into a single reused buffer so that no memory is
+    allocated for every block.
+    """
+    if not hasattr(stream, 'readinto'):
+        for data in iter(lambda: stream.read(block_size), ''):
+            state.update(data)
+        return
+    data = bytearray(block_size)
+    view = memoryview(data)
+    size = stream.readinto(data)
+    while size:
+        state.update(view[:size])
+        size = stream.readinto(data)
+
+
+def format_state(algorithm, hexdigest):
+    """States are prefixed by the algorithm that computed them so that the
+    workflow can tell when the algorithm changes. For backwards
+    compatibility, states of the default algorithm are not prefixed.
+    """
+    if algorithm == DEFAULT_ALGORITHM:
+        return hexdigest
+    return algorithm + ':' + hexdigest
+
+
+def get_state_algorithm(state):
+    """Get the algorithm that computed a state formatted by format_state"""
+    if state and ':' in state:
+        return state.split(':', 1)[0]
+    return DEFAULT_ALGORITHM
+
+
+# waiting on a pool result with a timeout is the only way to keep the
+# main thread responsive to KeyboardInterrupts in python 2
+_MAX_WAIT = 60 * 60 * 24 * 365
+
+# marks the threads that belong to a HashPool so that nested calls to
+# HashPool.map run serially rather than waiting on themselves
+_local = threading.local()
+
+
+def _call_in_worker(func_item):
+    func, item = func_item
+    _local.in_worker = True
+    return func(item)
+
+
+class HashPool(object):
+    """Bounded pool of `n_threads` threads that hash files concurrently.
+    Results are always returned in the same order as the inputs so
+    that digests that combine them remain deterministic.
+    """
+
+    def __init__(self, n_threads=None):
+        self.n_threads = n_threads or multiprocessing.cpu_count()
+        self._pool = None
+
+    def map(self, func, items):
+        """Apply `func` to every element of `items` concurrently"""
+        items = list(items)
+        serial = getattr(_local, 'in_worker', False)
+        if serial or self.n_threads < 2 or len(items) < 2:
+            return [func(item) for item in items]
+        if self._pool is None:
+            self._pool = ThreadPool(self.n_threads)
+        result = self._pool.map_async(
+            _call_in_worker, [(func, item) for item in items], chunksize=1,
+        )
+        return result.get(_MAX_WAIT)
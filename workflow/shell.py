@@ -1,47 +1,168 @@
 """Module for executing commands on the command line
 """
-import subprocess
+import os
 import sys
+import subprocess
 import logging
 import threading
+import select
 
 from . import exceptions
 
+# size of the chunks of output that are read from child processes
+CHUNK_SIZE = 2**16
+
+
+class OutputBuffer(object):
+    """Split the output of a child process into lines that are logged in
+    batches, one batch for every chunk of output, with an optional
+    `prefix` on every line and with the `extra` attributes of the log
+    records. Progress bars that redraw a line with carriage returns
+    (like curl) are reduced to their final state.
+    """
+
+    def __init__(self, prefix='', extra=None):
+        # output is logged as bytes, so the prefix (like task ids, which
+        # are unicode) is encoded to avoid decoding the output
+        if isinstance(prefix, unicode):
+            prefix = prefix.encode('utf-8')
+        self.prefix = prefix
+        self.extra = extra
+        self.logger = logging.getLogger('workflow')
+        self.pending = ''
+
+    def _last_redraw(self, line):
+        return line.rstrip('\r').rsplit('\r', 1)[-1]
+
+    def feed(self, data):
+        lines = (self.pending + data).split('\n')
+        self.pending = lines.pop()
+
+        # only the text after the last carriage return of the pending
+        # line is kept so that progress bars do not accumulate
+        if '\r' in self.pending[:-1]:
+            head, sep, tail = self.pending[:-1].rpartition('\r')
+            self.pending = tail + self.pending[-1]
+        self.log(lines)
+
+    def close(self):
+        if self.pending:
+            self.log([self.pending])
+        self.pending = ''
+
+    def log(self, lines):
+        if lines:
+            self.logger.info('\n'.join(
+                self.prefix + self._last_redraw(line) for line in lines
+            ), extra=self.extra)
+
+
+class ProcessRunner(object):
+    """Run shell commands in child processes. The output of all of the
+    child processes is multiplexed by a single thread with select.poll
+    (rather than a thread for every process) and it is forwarded to
+    the logger in batches.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buffers = {}
+        self.pending = []
+        self.done = {}
+        self.errors = {}
+        self.poll = select.poll()
+
+        # writing to this pipe wakes up the thread that polls the
+        # output of child processes when a new process is started
+        self.wakeup_fd, self.wakeup_write_fd = os.pipe()
+        self.poll.register(self.wakeup_fd, select.POLLIN)
+        thread = threading.Thread(target=self.forward_output)
+        thread.daemon = True
+        thread.start()
+
+    def run(self, directory, command, prefix='', extra=None):
+        # combine stderr and stdout output when running command so we can
+        # stream output to the logger for output to terminal and file
+        # simultaneously
+        wrapped_command = "cd %s && %s" % (directory, command)
+        pipe = subprocess.Popen(
+            wrapped_command, shell=True, close_fds=True,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        )
+        fd = pipe.stdout.fileno()
+        done = threading.Event()
+        with self.lock:
+            self.pending.append((fd, OutputBuffer(prefix, extra), done))
+        os.write(self.wakeup_write_fd, 'x')
+
+        # waiting with a timeout keeps the main thread responsive to
+        # KeyboardInterrupts in python 2
+        while not done.wait(1):
+            pass
+        pipe.stdout.close()
+        pipe.wait()
+
+        # errors while forwarding the output are raised in this thread
+        error = self.errors.pop(fd, None)
+        if error is not None:
+            raise error[0], error[1], error[2]
+
+        # if pipe is busted, raise an error
+        if pipe.returncode != 0:
+            raise exceptions.ShellError(pipe.returncode)
+
+    def register_pending(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+        for fd, output_buffer, done in pending:
+            self.buffers[fd] = output_buffer
+            self.done[fd] = done
+            self.poll.register(fd, select.POLLIN)
+
+    def forward_output(self):
+        while True:
+            for fd, event in self.poll.poll():
+                if fd == self.wakeup_fd:
+                    os.read(fd, CHUNK_SIZE)
+                    self.register_pending()
+                    continue
+
+                # an error while forwarding the output of one process
+                # stops forwarding it, but not the output of the others
+                try:
+                    self.forward_chunk(fd)
+                except Exception:
+                    self.errors[fd] = sys.exc_info()
+                    self.finish(fd)
+
+    def forward_chunk(self, fd):
+        data = os.read(fd, CHUNK_SIZE)
+        if data:
+            self.buffers[fd].feed(data)
+        else:
+            self.buffers[fd].close()
+            self.finish(fd)
+
+    def finish(self, fd):
+        """Stop polling `fd` and wake up the thread that runs its process"""
+        self.poll.unregister(fd)
+        self.buffers.pop(fd)
+        self.done.pop(fd).set()
+
+
+# _runner is a singleton instance of the ProcessRunner that is shared
+# by all of the commands that are run
+_runner = None
+_runner_lock = threading.Lock()
+
 
-def log_output(stream):
-    # this function logs the output from the subprocess'ed command.
-    #
-    # TODO: this works for all outputs that do not backspace. Note
-    # what happens when you run the workflow in examples/reuters-tfidf
-    # when curl is running
-    logger = logging.getLogger('workflow')
-    for line in iter(stream.readline, ''):
-        logger.info(line.rstrip('\n'))
-    stream.close()
-
-
-def run(directory, command):
-    """Run the specified shell command using Fabric-like behavior."""
-
-    # combine stderr and stdout output when running command so we can
-    # stream output to the logger for output to terminal and file
-    # simultaneously
-    wrapped_command = "cd %s && %s" % (directory, command)
-    pipe = subprocess.Popen(
-        wrapped_command, shell=True,
-        stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-    )
-
-    # this uses threading to capture the output in real time in a
-    # non-blocking way and use the log_output function to report the
-    # output using the logging module. This framework takes
-    # inspiration from http://stackoverflow.com/a/4985080/564709
-    thread = threading.Thread(target=log_output, args=(pipe.stdout,))
-    thread.daemon = True
-    thread.start()
-    thread.join()
-    pipe.wait()
-
-    # if pipe is busted, raise an error
-    if pipe.returncode != 0:
-        raise exceptions.ShellError(pipe.returncode)
+def run(directory, command, prefix='', extra=None):
+    """Run the specified shell command using Fabric-like behavior. Every
+    line of output is logged with `prefix` and the `extra` attributes
+    of the log records.
+    """
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = ProcessRunner()
+    _runner.run(directory, command, prefix, extra)
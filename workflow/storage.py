@@ -0,0 +1,274 @@
+"""This module manages the CSV files that workflow stores in the
+.workflow/ directory to keep track of the state of resources between
+runs, as well as the archives of workflows.
+"""
+
+import os
+import io
+import bz2
+import csv
+import math
+import tempfile
+import threading
+import collections
+import StringIO
+
+
+def read_rows(path):
+    """Read all of the rows of the CSV file located at `path`. If the file
+    does not exist, there are no rows.
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path) as stream:
+        return list(csv.reader(stream))
+
+
+def write_file(data, path):
+    """Atomically write the string `data` to the file located at `path` by
+    writing to a temporary file in the same directory and then
+    renaming it. This guarantees that an interrupted write never
+    leaves a partially written file behind.
+    """
+    directory = os.path.dirname(path) or '.'
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as stream:
+            stream.write(data)
+        os.rename(temp_path, path)
+    except:
+        os.remove(temp_path)
+        raise
+
+
+def write_rows(rows, path):
+    """Atomically write `rows` to the CSV file located at `path`"""
+    stream = StringIO.StringIO()
+    csv.writer(stream).writerows(rows)
+    write_file(stream.getvalue(), path)
+
+
+class StateStore(object):
+    """In-memory index of resource states keyed by resource name. The
+    underlying CSV file is only parsed once per run and it is written
+    back atomically with StateStore.save.
+
+    Each row can optionally store the stat fingerprint (size,
+    mtime_ns, inode) of a file next to its content hash, which makes
+    it possible to avoid hashing files that have not been touched.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.states = {}
+        self.stats = {}
+        self.load()
+
+    def load(self):
+        self.clear()
+        for row in read_rows(self.path):
+            self.states[row[0]] = row[1]
+            if len(row) > 2:
+                self.stats[row[0]] = tuple(int(x) for x in row[2:])
+
+    def get(self, name):
+        return self.states.get(name)
+
+    def get_stat(self, name):
+        return self.stats.get(name)
+
+    def update(self, states, stats=None):
+        """Update the stored `states`. Any stat fingerprint that was
+        previously stored for these names is discarded unless a new
+        one is specified in `stats`.
+        """
+        self.states.update(states)
+        for name in states:
+            self.stats.pop(name, None)
+        self.stats.update(stats or {})
+
+    def prune(self, prefix, names):
+        """Discard the states of every name that starts with `prefix` but
+        is not one of `names`
+        """
+        for name in self.states.keys():
+            if name.startswith(prefix) and name not in names:
+                del self.states[name]
+                self.stats.pop(name, None)
+
+    def clear(self):
+        self.states.clear()
+        self.stats.clear()
+
+    def iter_rows(self):
+        for name, state in sorted(self.states.iteritems()):
+            yield (name, state) + self.stats.get(name, ())
+
+    def save(self):
+        write_rows(self.iter_rows(), self.path)
+
+
+def percentile(values, p):
+    """Nearest-rank percentile `p` (between 0 and 100) of `values`"""
+    values = sorted(values)
+    index = int(math.ceil(p / 100.0 * len(values))) - 1
+    return values[max(index, 0)]
+
+
+class TaskRun(collections.namedtuple('TaskRun', [
+        'timestamp', 'task_id', 'duration', 'exit_code', 'host',
+        'input_size'])):
+    """A single run of a task as it is recorded in the duration history"""
+
+    @classmethod
+    def from_row(cls, row):
+        timestamp, task_id, duration, exit_code, host, input_size = row
+        return cls(timestamp, task_id, float(duration), int(exit_code),
+                   host, int(input_size or 0))
+
+
+class DurationHistory(object):
+    """Append-only history of every task run, stored in a CSV file with
+    one row per run. The history is loaded once and indexed by task
+    id so that percentiles of the durations are cheap to query.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.runs = collections.defaultdict(list)
+        self.lock = threading.Lock()
+        for row in read_rows(self.path):
+            self.add(TaskRun.from_row(row))
+
+    def add(self, run):
+        self.runs[run.task_id].append(run)
+
+    def append(self, run):
+        """Record `run` in the history, both in memory and on disk. This is
+        safe to call from concurrently running tasks.
+        """
+        with self.lock:
+            self.add(run)
+            with open(self.path, 'a') as stream:
+                csv.writer(stream).writerow(run)
+
+    def get_task_ids(self):
+        return self.runs.keys()
+
+    def get_runs(self, task_id):
+        return self.runs.get(task_id, [])
+
+    def get_durations(self, task_id):
+        """Get the durations of all successful runs of task_id"""
+        return [run.duration for run in self.get_runs(task_id)
+                if run.exit_code == 0]
+
+    def get_percentile(self, task_id, p):
+        """Get the `p` percentile of the duration of successful runs of
+        task_id, or None if it has never successfully run.
+        """
+        durations = self.get_durations(task_id)
+        if durations:
+            return percentile(durations, p)
+
+
+class ArchiveStore(object):
+    """Content-addressed store of archived files in `directory`. The
+    contents of every file are compressed once into a blob that is
+    named after the state of the file, so unchanged files are shared
+    by all of the archives that contain them. Every archive is a CSV
+    manifest of the (path, mode, state) of its files, followed by the
+    stat fingerprint of every file when it was archived.
+    """
+
+    def __init__(self, directory, block_size=2**20):
+        self.directory = directory
+        self.blobs_directory = os.path.join(directory, 'blobs')
+        self.block_size = block_size
+
+    def blob_path(self, state):
+        """Blobs are spread over subdirectories by the first characters of
+        their digest so that no directory gets too large
+        """
+        digest = state.rsplit(':', 1)[-1]
+        return os.path.join(
+            self.blobs_directory, digest[:2], state.replace(':', '-') + '.bz2',
+        )
+
+    def has_blob(self, state):
+        return os.path.exists(self.blob_path(state))
+
+    def add(self, path, state):
+        """Compress the file at `path` into the blob for its `state`, unless
+        that blob is already stored. Returns whether a blob was added.
+        """
+        blob_path = self.blob_path(state)
+        if os.path.exists(blob_path):
+            return False
+        directory = os.path.dirname(blob_path)
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # another thread created the same directory
+                pass
+
+        # the blob is compressed in blocks into a temporary file that is
+        # only renamed once it is complete (see write_file)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            compressor = bz2.BZ2Compressor()
+            with os.fdopen(fd, 'wb') as stream:
+                with io.open(path, 'rb') as in_stream:
+                    for data in iter(
+                        lambda: in_stream.read(self.block_size), '',
+                    ):
+                        stream.write(compressor.compress(data))
+                stream.write(compressor.flush())
+            os.rename(temp_path, blob_path)
+        except:
+            os.remove(temp_path)
+            raise
+        return True
+
+    def iter_blob(self, state):
+        """Iterate over the decompressed contents of the blob for `state` in
+        blocks
+        """
+        decompressor = bz2.BZ2Decompressor()
+        with io.open(self.blob_path(state), 'rb') as stream:
+            for data in iter(lambda: stream.read(self.block_size), ''):
+                yield decompressor.decompress(data)
+
+    def extract(self, state, path, mode):
+        """Atomically write the contents of the blob for `state` to `path`"""
+        directory = os.path.dirname(path) or '.'
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as stream:
+                for data in self.iter_blob(state):
+                    stream.write(data)
+            os.chmod(temp_path, mode)
+            os.rename(temp_path, path)
+        except:
+            os.remove(temp_path)
+            raise
+
+    def write_manifest(self, name, entries):
+        """Store the (path, mode, state, stat) `entries` of an archive"""
+        write_rows(
+            sorted((path, mode, state) + stat
+                   for path, mode, state, stat in entries),
+            os.path.join(self.directory, name),
+        )
+
+    def read_manifest(self, name):
+        """Read the (path, mode, state, stat) entries of an archive. The
+        stat fingerprint is empty for archives that did not store it.
+        """
+        return [
+            (row[0], int(row[1]), row[2], tuple(int(x) for x in row[3:]))
+            for row in read_rows(os.path.join(self.directory, name))
+        ]
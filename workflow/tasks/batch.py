@@ -0,0 +1,102 @@
+"""Batches of tasks that were expanded from the same pattern task and that
+run together with a single command to avoid the overhead of starting a
+shell process for every (small) task.
+"""
+
+import os
+import time
+import datetime
+import socket
+
+from ..exceptions import ShellError
+from .. import colors
+from .. import shell
+from .. import storage
+
+
+class Batch(object):
+    """Run several `tasks` that share a batch_key with the command of the
+    first task, rendered with the files of all of them in
+    `{{depends_batch}}`.
+    """
+
+    # see Task.output_prefix
+    output_prefix = ''
+
+    def __init__(self, tasks):
+        self.tasks = tasks
+        self.graph = tasks[0].graph
+        self.command_list = tasks[0].render_batch_command(tasks)
+        self.start_time = None
+        self.duration = None
+
+        # the output of the batch is stored in the log of every task
+        self.log_extra = {'task_ids': [task.id for task in tasks]}
+
+    def timed_run(self):
+        """Run the batch command from the root of the workflow"""
+        for task in self.tasks:
+            self.graph.logger.info(
+                task.creates_message(), extra=self.log_extra,
+            )
+        self.start_time = time.time()
+
+        # like Task.timed_run, the resources of every task have
+        # (potentially) changed whether or not the commands succeed
+        exit_code = 1
+        try:
+            for command in self.command_list:
+                self.graph.logger.info(
+                    self.tasks[0].command_message(command),
+                    extra=self.log_extra,
+                )
+                shell.run(
+                    self.graph.root_directory, command, self.output_prefix,
+                    self.log_extra,
+                )
+            exit_code = 0
+        except ShellError, e:
+            exit_code = e.exit_code
+            raise
+        finally:
+            for task in self.tasks:
+                self.graph.state_cache.invalidate(task.creates_resources)
+            self.record_history(exit_code)
+
+        # alert the user to the clock time spent running the batch
+        self.graph.logger.info(colors.blue(
+            "%79s" % self.graph.duration_string(self.duration)
+        ), extra=self.log_extra)
+
+    def record_history(self, exit_code):
+        """Record the run of every task in the duration history. The time
+        spent running the batch is split evenly among its tasks.
+        """
+        self.duration = time.time() - self.start_time
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+        finished_tasks = self.get_finished_tasks()
+        for task in self.tasks:
+            task.duration = self.duration / len(self.tasks)
+            self.graph.history.append(storage.TaskRun(
+                timestamp, task.id, task.duration,
+                0 if task in finished_tasks else exit_code,
+                socket.gethostname(), task.get_input_size(),
+            ))
+
+    def get_finished_tasks(self):
+        """Get the tasks whose `creates` were all (re)written since this
+        batch started. When a batch fails, only the other tasks need to
+        run again.
+        """
+        # modification times can be truncated to whole seconds
+        start_time = int(self.start_time)
+        finished_tasks = set()
+        for task in self.tasks:
+            paths = [
+                os.path.join(self.graph.root_directory, creates)
+                for creates in task.creates_list
+            ]
+            if all(os.path.exists(path) and
+                   os.path.getmtime(path) >= start_time for path in paths):
+                finished_tasks.add(task)
+        return finished_tasks
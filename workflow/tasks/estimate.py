@@ -0,0 +1,64 @@
+"""Estimate how long it takes to run a set of tasks from the durations
+that were recorded the last time they ran.
+"""
+
+import heapq
+
+
+def _count_upstream(tasks):
+    task_set = set(tasks)
+    return dict((task, len(task.upstream_tasks & task_set)) for task in tasks)
+
+
+def estimate_makespan(tasks, durations, jobs=1):
+    """Simulate running the topologically ordered `tasks` with up to `jobs`
+    tasks at a time, starting every task as soon as its upstream tasks
+    have finished (just like the Scheduler does), and return the
+    total elapsed time. `durations` maps tasks to their expected
+    duration.
+    """
+    order = dict((task, i) for i, task in enumerate(tasks))
+    n_upstream = _count_upstream(tasks)
+    ready = [(order[t], t) for t in tasks if n_upstream[t] == 0]
+    heapq.heapify(ready)
+    running, now = [], 0.0
+    while ready or running:
+        while ready and len(running) < max(jobs, 1):
+            dummy, task = heapq.heappop(ready)
+            item = (now + durations.get(task, 0.0), order[task], task)
+            heapq.heappush(running, item)
+        now, dummy, task = heapq.heappop(running)
+        for downstream_task in task.downstream_tasks:
+            if downstream_task in n_upstream:
+                n_upstream[downstream_task] -= 1
+                if n_upstream[downstream_task] == 0:
+                    item = (order[downstream_task], downstream_task)
+                    heapq.heappush(ready, item)
+    return now
+
+
+def get_critical_path(tasks, durations):
+    """Find the longest chain of dependent tasks among the topologically
+    ordered `tasks`. No matter how many tasks run concurrently, the
+    workflow can not finish faster than this chain of tasks.
+    """
+    if not tasks:
+        return []
+    order = dict((task, i) for i, task in enumerate(tasks))
+    finish, previous = {}, {}
+    for task in tasks:
+        upstream_tasks = sorted(
+            (t for t in task.upstream_tasks if t in finish), key=order.get,
+        )
+        before = None
+        if upstream_tasks:
+            before = max(upstream_tasks, key=finish.get)
+        finish[task] = durations.get(task, 0.0) + finish.get(before, 0.0)
+        previous[task] = before
+    task = max(tasks, key=finish.get)
+    critical_path = []
+    while task is not None:
+        critical_path.append(task)
+        task = previous[task]
+    critical_path.reverse()
+    return critical_path
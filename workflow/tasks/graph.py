@@ -1,18 +1,27 @@
 import sys
 import os
 import time
-import csv
-import collections
+import heapq
 import datetime
 import glob
+import copy
+import fnmatch
 from distutils.util import strtobool
 
+import jinja2
+from jinja2.utils import LRUCache
+
 from ..exceptions import InvalidTaskDefinition, NonUniqueTask, ShellError
+from ..exceptions import DependencyCycle, TaskNotFound
 from .. import colors
 from .. import shell
 from .. import resources
 from .. import logger
+from .. import storage
 from .task import Task
+from .scheduler import Scheduler
+from . import estimate
+from . import pattern
 
 
 class TaskGraph(object):
@@ -22,13 +31,28 @@ class TaskGraph(object):
     internals_path = ".workflow"
     state_path = os.path.join(internals_path, "state.csv")
     duration_path = os.path.join(internals_path, "duration.csv")
+    history_path = os.path.join(internals_path, "history.csv")
     log_path = os.path.join(internals_path, "workflow.log")
+    logs_dir = os.path.join(internals_path, "logs")
     archive_dir = os.path.join(internals_path, "archive")
+    compiled_path = os.path.join(internals_path, "graph.pickle")
+
+    # maximum number of compiled templates that are kept in memory
+    template_cache_size = 1000
+
+    # views of graphs that only contain some of the tasks (see
+    # subgraph) only know about some of the resources
+    is_subgraph = False
 
-    def __init__(self, config_path, task_kwargs_list):
+    def __init__(self, config_path, task_kwargs_list, settings=None,
+                 compiled=None):
         self.task_list = []
         self.task_dict = {}
 
+        # settings that change how this workflow is evaluated, as
+        # specified in the `settings` of the workflow.yaml
+        self.settings = settings or {}
+
         # store paths once for all tasks and make sure the base
         # directory exists
         self.config_path = config_path
@@ -43,8 +67,40 @@ class TaskGraph(object):
         # values are resource instances
         self.resource_dict = {}
 
-        # store the time that this task takes
-        self.task_durations = {}
+        # snapshot of directory contents that is used to quickly check
+        # whether the files that tasks depend on exist
+        self.directory_listings = resources.DirectoryListings()
+
+        # load the stored states of all resources once so that
+        # checking whether resources are in sync does not require
+        # re-reading the state file
+        self.state_store = storage.StateStore(self.abs_state_path)
+
+        # cache the current states of resources during this run so
+        # that every resource is hashed at most once
+        self.state_cache = resources.StateCache()
+
+        # bounded pool of threads that is used to hash many files at
+        # once
+        self.hash_pool = resources.HashPool(self.settings.get('hash_threads'))
+
+        # hash algorithm that is used to compute the state of every
+        # resource in this workflow. creating a new hash up front makes
+        # sure that the algorithm is available.
+        self.hash_algorithm = self.settings.get(
+            'hash', resources.hashing.DEFAULT_ALGORITHM,
+        )
+        resources.hashing.new_hash(self.hash_algorithm)
+
+        # all templates are rendered by the same environment. templates
+        # are compiled once for every unique template string so that
+        # generated workflows that repeat the same templates over and
+        # over are parsed quickly
+        undefined = jinja2.Undefined
+        if self.settings.get('strict_templates'):
+            undefined = jinja2.StrictUndefined
+        self.template_environment = jinja2.Environment(undefined=undefined)
+        self.template_cache = LRUCache(self.template_cache_size)
 
         # instantiate the logger instance for this workflow
         self.logger = logger.configure(self)
@@ -53,43 +109,100 @@ class TaskGraph(object):
         # in an intelligent way
         self.successful = False
 
-        # add tasks and load all dependencies between tasks
-        for task_kwargs in task_kwargs_list:
-            task = Task(self, **task_kwargs)
+        # directories that are searched for the files that match the
+        # patterns of pattern tasks
+        self.pattern_directories = []
+
+        # add tasks and load all dependencies between tasks. tasks that
+        # were compiled by TaskGraph.compile do not need to be rendered
+        # (or expanded from patterns) again
+        if compiled is None:
+            for task_kwargs in task_kwargs_list:
+                if pattern.get_pattern(task_kwargs):
+                    self._add_pattern_tasks(task_kwargs)
+                else:
+                    task = Task(self, **task_kwargs)
+        else:
+            self.pattern_directories = compiled['pattern_directories']
+            for compiled_task in compiled['tasks']:
+                task = Task.from_compiled(self, compiled_task)
         self._dereference_depends_aliases()
         self._link_dependencies()
+        self._sort_topologically()
+        self._resolve_pseudotask_resources()
         self._load_state()
 
     def iter_graph(self, tasks=None, downstream=True):
-        """Iterate over graph with breadth-first search of task dependencies,
-        starting from `tasks` or the set of tasks that do not depend
-        on anything.
-        http://en.wikipedia.org/wiki/Breadth-first_search
+        """Iterate over the graph in topological order, starting from `tasks`
+        and including every task downstream of them. Every task is
+        guaranteed to come after all of the tasks it depends on. If
+        `downstream` is False, iterate over `tasks` and every task
+        upstream of them in reverse topological order instead.
         """
-        if downstream:
-            tasks = tasks or self.get_source_tasks()
-            popmethod = 'popleft'
-            updownstream = 'downstream_tasks'
+        if tasks:
+            closure = self._get_closure(tasks, downstream)
+            task_order = sorted(closure, key=self.topological_index.get)
         else:
-            tasks = tasks or self.get_sink_tasks()
-            popmethod = 'pop'
-            updownstream = 'upstream_tasks'
-        horizon = collections.deque(tasks)
-        done, horizon_set = set(), set(tasks)
-        task_order = []
-        popmethod = getattr(horizon, popmethod)
-        while horizon:
-            task = popmethod()
-            horizon_set.discard(task)
-            done.add(task)
-            task_order.append(task)
-            updownset = getattr(task, updownstream)
-            for task in updownset.difference(done):
-                if task not in horizon_set:
-                    horizon.append(task)
-                    horizon_set.add(task)
+            task_order = list(self.topological_order)
+        if not downstream:
+            task_order.reverse()
         return task_order
 
+    def _get_closure(self, tasks, downstream=True):
+        """Get the set of `tasks` and every task downstream (or upstream) of
+        them that belongs to this graph.
+        """
+        updownstream = 'downstream_tasks' if downstream else 'upstream_tasks'
+        closure, horizon = set(), list(tasks)
+        while horizon:
+            task = horizon.pop()
+            if task not in closure and task in self.topological_index:
+                closure.add(task)
+                horizon.extend(getattr(task, updownstream))
+        return closure
+
+    def _sort_topologically(self):
+        """Sort all tasks topologically with Kahn's algorithm
+        http://en.wikipedia.org/wiki/Topological_sorting. The in-degree
+        of every task and the resulting order are computed once and
+        cached on the graph. Ties are broken by the order in which
+        tasks are defined in the workflow.yaml.
+        """
+        position = dict((task, i) for i, task in enumerate(self.task_list))
+        self.in_degree = {}
+        horizon = []
+        for task in self.task_list:
+            self.in_degree[task] = len(task.upstream_tasks)
+            if self.in_degree[task] == 0:
+                heapq.heappush(horizon, (position[task], task))
+        in_degree = dict(self.in_degree)
+        self.topological_order = []
+        while horizon:
+            dummy, task = heapq.heappop(horizon)
+            self.topological_order.append(task)
+            for downstream_task in task.downstream_tasks:
+                in_degree[downstream_task] -= 1
+                if in_degree[downstream_task] == 0:
+                    item = (position[downstream_task], downstream_task)
+                    heapq.heappush(horizon, item)
+        if len(self.topological_order) < len(self.task_list):
+            raise DependencyCycle(self._find_cycle(in_degree))
+        self.topological_index = dict(
+            (task, i) for i, task in enumerate(self.topological_order)
+        )
+
+    def _find_cycle(self, in_degree):
+        """Find a cycle among the tasks that could not be sorted
+        topologically by following upstream tasks until one repeats.
+        """
+        unsorted = set(t for t in self.task_list if in_degree[t] > 0)
+        path = [min(unsorted, key=self.task_list.index)]
+        while path.count(path[-1]) < 2:
+            upstream_tasks = path[-1].upstream_tasks & unsorted
+            path.append(min(upstream_tasks, key=self.task_list.index))
+        cycle = path[path.index(path[-1]):]
+        return [task.id for task in reversed(cycle)]
+
     def get_source_tasks(self):
         """Get the set of tasks that do not depend on anything else.
         """
@@ -100,21 +213,70 @@ class TaskGraph(object):
         return source_tasks
 
     def get_sink_tasks(self):
-        """Get the set of tasks that do not have any dependencies.
+        """Get the set of tasks that no other task in this graph depends on.
         """
         sink_tasks = set()
         for task in self.task_list:
-            if not task.downstream_tasks:
+            if not any(t in self.topological_index
+                       for t in task.downstream_tasks):
                 sink_tasks.add(task)
         return sink_tasks
 
     def get_out_of_sync_tasks(self):
+        # hash everything that is needed to check whether the tasks are
+        # in sync concurrently before checking them one at a time. the
+        # dependencies of tasks whose configuration changed are not
+        # needed (see Task.in_sync)
+        tasks = [task for task in self.task_list if not task.is_pseudotask()]
+        self.state_cache.prefetch(tasks, self.hash_pool)
+        resources_to_check = []
+        for task in tasks:
+            if task.state_in_sync():
+                resources_to_check.extend(task.depends_resources)
+        self.state_cache.prefetch(resources_to_check, self.hash_pool)
         out_of_sync_tasks = []
         for task in self.iter_graph():
             if not task.is_pseudotask() and not task.in_sync():
                 out_of_sync_tasks.append(task)
         return out_of_sync_tasks
 
+    def get_template(self, template_str):
+        """Get the compiled jinja template for `template_str`"""
+        template = self.template_cache.get(template_str)
+        if template is None:
+            template = self.template_environment.from_string(template_str)
+            self.template_cache[template_str] = template
+        return template
+
+    def _add_pattern_tasks(self, task_kwargs):
+        """Add a task for every file that matches the pattern in the
+        `depends` of `task_kwargs`. If the pattern task has an `alias`,
+        it becomes a pseudotask that depends on all of these tasks.
+        """
+        directory, regex = pattern.split_pattern(
+            pattern.get_pattern(task_kwargs)
+        )
+        self.pattern_directories.append(directory or os.curdir)
+        tasks = [
+            Task(self, **kwargs) for kwargs in pattern.expand(
+                task_kwargs, self.root_directory, self.directory_listings,
+            )
+        ]
+        if tasks and tasks[0].batch_size > 1:
+            tasks[0].check_batch_command()
+        if task_kwargs.get('alias') is not None:
+            Task(self, creates=task_kwargs['alias'],
+                 depends=[task.creates for task in tasks])
+
+    def compile(self):
+        """Get the rendered attributes of every task so that this graph can
+        be quickly recreated without parsing the workflow.yaml again
+        """
+        return {
+            'tasks': [task.compile() for task in self.task_list],
+            'pattern_directories': self.pattern_directories,
+        }
+
     def get_task_ids(self):
         """Get the list of all task ids"""
         return [task.id for task in self.task_list]
@@ -138,25 +300,65 @@ class TaskGraph(object):
             )
         self.task_dict[task.creates] = task
 
+    def find_tasks(self, patterns):
+        """Find the tasks whose `creates` or `alias` match any of the
+        `patterns`, which can contain shell-style wildcards like
+        `data/per_file/*`. Every pattern must match at least one task.
+        """
+        tasks = []
+        for pattern in patterns:
+            if pattern in self.task_dict:
+                matches = [pattern]
+            else:
+                matches = sorted(fnmatch.filter(self.task_dict, pattern))
+            if not matches:
+                raise TaskNotFound(pattern)
+            tasks.extend(self.task_dict[match] for match in matches)
+        return tasks
+
     def subgraph_needed_for(self, task_ids):
-        """Find the subgraph of all dependencies to run these tasks"""
+        """Find the subgraph of all dependencies to run these tasks, which
+        can be specified by (wildcard) patterns of their ids
+        """
         if not task_ids:
             return self
+        tasks = self.find_tasks(task_ids)
+        return self.subgraph(self._get_closure(tasks, downstream=False))
+
+    def subgraph(self, tasks):
+        """Get a view of this graph that only contains `tasks`. The view
+        shares the tasks, resources, stored states and caches of this
+        graph, so nothing needs to be rendered, hashed or instantiated
+        again.
+        """
+        tasks = set(tasks)
+        subgraph = copy.copy(self)
+        subgraph.is_subgraph = True
+        subgraph.task_list = [t for t in self.task_list if t in tasks]
+        subgraph.topological_order = [
+            t for t in self.topological_order if t in tasks
+        ]
+        subgraph.topological_index = dict(
+            (t, i) for t, i in self.topological_index.iteritems()
+            if t in tasks
+        )
 
-        # instantiate a new graph instance from the original data from
-        # the tasks of self
-        tasks = map(self.task_dict.get, task_ids)
-        tasks_kwargs_list = [task.yaml_data for task in
-                             self.iter_graph(tasks, downstream=False)]
-        subgraph = TaskGraph(self.config_path, tasks_kwargs_list)
+        # only the states of the resources that are used by this
+        # subgraph are saved after running it
+        subgraph.resource_dict = {}
+        for task in subgraph.task_list:
+            resources = [task] + task.depends_resources
+            resources.extend(task.creates_resources)
+            for resource in resources:
+                subgraph.resource_dict[resource.name] = resource
         return subgraph
 
     def _dereference_alias_helper(self, name):
         if name is None:
             return None
-        for task in self.task_list:
-            if task.alias == name:
-                return task.creates
+        task = self.task_dict.get(name)
+        if task is not None and task.alias == name:
+            return task.creates
 
     def _dereference_depends_aliases(self):
         """This converts every alias used in a depends statement into the
@@ -181,7 +383,7 @@ class TaskGraph(object):
             # filesystem otherwise this Task is not properly defined
             if dependent_task is None:
                 filename = os.path.join(self.root_directory, dependency)
-                if not os.path.exists(filename):
+                if not self.directory_listings.exists(filename):
                     raise InvalidTaskDefinition(
                         "Unknown `depends` declaration '%s'" % dependency
                     )
@@ -215,6 +417,26 @@ class TaskGraph(object):
             for dependency in task.depends_list:
                 self._link_dependency_helper(task, dependency)
 
+    def _resolve_pseudotask_resources(self):
+        """Pseudotasks do not create anything themselves, so tasks that
+        depend on a pseudotask depend on all of the resources that the
+        pseudotask depends on instead.
+        """
+        for task in self.topological_order:
+            depends_resources, seen = [], set()
+            for resource in task.depends_resources:
+                pseudotask = self.task_dict.get(resource.name)
+                if pseudotask is not None and pseudotask.is_pseudotask():
+                    self.resource_dict.pop(resource.name, None)
+                    resolved = pseudotask.depends_resources
+                else:
+                    resolved = [resource]
+                for resource in resolved:
+                    if resource not in seen:
+                        seen.add(resource)
+                        depends_resources.append(resource)
+            task.depends_resources = depends_resources
+
     def get_user_clean_confirmation(self, task_list=None,
                                     include_internals=False):
         """This method gets user confirmation about cleaning up the workflow"""
@@ -239,6 +461,7 @@ class TaskGraph(object):
         """
         if os.path.exists(self.abs_state_path) and task_list is None:
             os.remove(self.abs_state_path)
+            self.state_store.clear()
         if include_internals:
             shell.run(self.root_directory, "rm -rf %s" % self.internals_path)
             self.logger.info(
@@ -258,22 +481,37 @@ class TaskGraph(object):
         else:
             return "%.2f" % (duration / 60 / 60 / 24) + " d"
 
-    def duration_message(self, tasks, color=colors.blue):
+    def get_expected_durations(self, tasks):
+        """Get the expected duration of each of the `tasks` based on previous
+        runs. Tasks that have never been run are omitted.
+        """
+        durations = {}
+        for task in tasks:
+            if task.is_pseudotask():
+                durations[task] = 0.0
+                continue
+            duration = self.history.get_percentile(task.id, 50)
+            if duration is not None:
+                durations[task] = duration
+        return durations
+
+    def duration_message(self, tasks, color=colors.blue, jobs=1):
         if len(tasks) == 0:
             return "No tasks are out of sync in this workflow (%s)" % (
                 os.path.relpath(self.config_path, os.getcwd())
             )
-        min_duration = 0.0
-        for task in tasks:
-            min_duration += self.task_durations.get(task.id, 0.0)
-        max_duration, n_unknown, n_tasks = 0.0, 0, 0
-        for task in self.iter_graph(tasks):
-            if not task.is_pseudotask():
-                n_tasks += 1
-                try:
-                    max_duration += self.task_durations[task.id]
-                except KeyError:
-                    n_unknown += 1
+
+        # estimate the time it takes to run just the `tasks` and the
+        # time it takes to run them and everything downstream of
+        # them, assuming that up to `jobs` tasks are run at once
+        all_tasks = self.iter_graph(tasks)
+        durations = self.get_expected_durations(all_tasks)
+        min_duration = estimate.estimate_makespan(
+            sorted(tasks, key=self.topological_index.get), durations, jobs,
+        )
+        max_duration = estimate.estimate_makespan(all_tasks, durations, jobs)
+        n_tasks = len([t for t in all_tasks if not t.is_pseudotask()])
+        n_unknown = len([t for t in all_tasks if t not in durations])
         msg = ''
         if n_unknown > 0:
             msg += "%d new tasks with unknown durations.\n" % (
@@ -284,41 +522,83 @@ class TaskGraph(object):
             n_tasks,
         )
         if max_duration == min_duration == 0.0:
-            msg += "which will take an indeterminate amount of time."
+            msg += "which will take an indeterminate amount of time"
         elif max_duration == min_duration:
-            msg += "which will take approximately %s." % (
+            msg += "which will take approximately %s" % (
                 self.duration_string(min_duration),
             )
         else:
-            msg += "which will take between %s and %s." % (
+            msg += "which will take between %s and %s" % (
                 self.duration_string(min_duration),
                 self.duration_string(max_duration),
             )
+        if jobs > 1:
+            msg += " with %d jobs" % jobs
+        msg += "."
+        if color:
+            msg = color(msg)
+        return msg
+
+    def critical_path_message(self, tasks, color=colors.blue):
+        """Describe the longest chain of dependent tasks that need to be
+        executed. These are the tasks that are worth optimizing first
+        to speed up a workflow.
+        """
+        if not tasks:
+            return ''
+        all_tasks = self.iter_graph(tasks)
+        durations = self.get_expected_durations(all_tasks)
+        critical_path = estimate.get_critical_path(all_tasks, durations)
+        critical_path = [t for t in critical_path if not t.is_pseudotask()]
+
+        # without any recorded durations, every path is just as long
+        if not any(t in durations for t in critical_path):
+            return ''
+        total_duration = sum(durations.get(t, 0.0) for t in critical_path)
+        msg = "The critical path takes %s:" % (
+            self.duration_string(total_duration),
+        )
+        for task in critical_path:
+            duration = durations.get(task)
+            duration = '?' if duration is None else \
+                self.duration_string(duration)
+            msg += "\n%-68s%11s" % (task.id, duration)
         if color:
             msg = color(msg)
         return msg
 
-    def _run_helper(self, starting_tasks, do_run_func, mock_run):
+    def _run_helper(self, starting_tasks, do_run_func, mock_run, jobs=1):
         """This is a convenience method that is used to slightly modify the
         behavior of running a workflow depending on the circumstances.
         """
-        self.logger.info(self.duration_message(starting_tasks))
-        for task in self.iter_graph(starting_tasks):
-            if do_run_func(task):
-                if mock_run:
+        self.logger.info(self.duration_message(starting_tasks, jobs=jobs))
+        if not starting_tasks:
+            # iter_graph would iterate over the entire graph, but there
+            # is nothing to run. the states of resources (and their
+            # fingerprints) are still saved for next time
+            if not mock_run:
+                self.save_state()
+            return
+        if mock_run:
+            critical_path_message = self.critical_path_message(starting_tasks)
+            if critical_path_message:
+                self.logger.info(critical_path_message)
+            for task in self.iter_graph(starting_tasks):
+                if do_run_func(task):
                     task.mock_run()
-                else:
-                    try:
-                        task.timed_run()
-                    except (KeyboardInterrupt, ShellError), e:
-                        self.save_state(
-                            override_resource_states={task.name: ''},
-                        )
-                        sys.exit(getattr(e, 'exit_code', 1))
-        if not mock_run:
-            self.save_state()
-
-    def run_all(self, mock_run=False):
+            return
+
+        # run the tasks with up to `jobs` tasks running concurrently
+        scheduler = Scheduler(
+            self, self.iter_graph(starting_tasks), do_run_func, jobs,
+        )
+        try:
+            scheduler.run()
+        except (KeyboardInterrupt, ShellError), e:
+            sys.exit(getattr(e, 'exit_code', 1))
+        self.save_state()
+
+    def run_all(self, mock_run=False, jobs=1):
         """Execute all tasks in the workflow, regardless of whether they are
         in sync or not.
         """
@@ -327,9 +607,9 @@ class TaskGraph(object):
         def do_run_func(task):
             return not task.is_pseudotask()
 
-        self._run_helper(starting_tasks, do_run_func, mock_run)
+        self._run_helper(starting_tasks, do_run_func, mock_run, jobs)
 
-    def run_all_out_of_sync(self, mock_run=False):
+    def run_all_out_of_sync(self, mock_run=False, jobs=1):
         """Execute all tasks in the workflow that are out of sync at runtime.
         """
         starting_tasks = self.get_out_of_sync_tasks()
@@ -337,7 +617,7 @@ class TaskGraph(object):
         def do_run_func(task):
             return not task.is_pseudotask() and not task.in_sync()
 
-        self._run_helper(starting_tasks, do_run_func, mock_run)
+        self._run_helper(starting_tasks, do_run_func, mock_run, jobs)
 
     @property
     def abs_state_path(self):
@@ -349,78 +629,182 @@ class TaskGraph(object):
         """Convenience property for accessing duration storage location"""
         return os.path.join(self.root_directory, self.duration_path)
 
+    @property
+    def abs_history_path(self):
+        """Convenience property for accessing duration history location"""
+        return os.path.join(self.root_directory, self.history_path)
+
+    @property
+    def abs_compiled_path(self):
+        """Convenience property for accessing the compiled graph location"""
+        return os.path.join(self.root_directory, self.compiled_path)
+
     @property
     def abs_log_path(self):
         """Convenience property for accessing log storage location"""
         return os.path.join(self.root_directory, self.log_path)
 
+    @property
+    def abs_logs_dir(self):
+        """Convenience property for accessing the logs of every run"""
+        return os.path.join(self.root_directory, self.logs_dir)
+
     @property
     def abs_archive_dir(self):
         """Convenience property for accessing the archive location"""
         return os.path.join(self.root_directory, self.archive_dir)
 
     def read_from_storage(self, storage_location):
-        dictionary = {}
-        if os.path.exists(storage_location):
-            with open(storage_location) as stream:
-                reader = csv.reader(stream)
-                for row in reader:
-                    dictionary[row[0]] = row[1]
-        return dictionary
+        return dict(row[:2] for row in storage.read_rows(storage_location))
 
     def write_to_storage(self, dictionary, storage_location):
-        with open(storage_location, 'w') as stream:
-            writer = csv.writer(stream)
-            for item in dictionary.iteritems():
-                writer.writerow(item)
+        storage.write_rows(sorted(dictionary.items()), storage_location)
 
     def get_state_from_storage(self, resource):
-        if os.path.exists(self.abs_state_path):
-            with open(self.abs_state_path) as stream:
-                reader = csv.reader(stream)
-                for row in reader:
-                    if row[0] == resource:
-                        return row[1]
+        return self.state_store.get(resource)
 
     def _load_state(self):
         """Load the states of all resources (files, databases, etc). If the
         state file hasn't been stored yet, nothing happens. This also
         loads the duration statistics on this task.
         """
-        self.task_durations.update(
-            self.read_from_storage(self.abs_duration_path)
-        )
-
-        # typecast the task_durations
-        for task_id, duration in self.task_durations.iteritems():
-            self.task_durations[task_id] = float(duration)
-
-    def save_state(self, override_resource_states=None):
+        self.history = storage.DurationHistory(self.abs_history_path)
+
+        # the durations of tasks used to be stored in a CSV with only
+        # the last duration of each task. convert them to the
+        # beginning of the duration history.
+        if os.path.exists(self.abs_duration_path):
+            if not self.history.get_task_ids():
+                durations = self.read_from_storage(self.abs_duration_path)
+                for task_id, duration in sorted(durations.iteritems()):
+                    self.history.append(storage.TaskRun(
+                        '', task_id, float(duration), 0, '', 0,
+                    ))
+            os.remove(self.abs_duration_path)
+
+    def save_state(self, override_resource_states=None, resources=None):
         """Save the states of all resources (files, databases, etc). If the
         state file hasn't been stored yet, it creates a new one. Can
         optionally pass override_resource_states to set the states of
         particular elements, which can be useful for handling keyboard
-        interrupts, for example.
+        interrupts, for example. If `resources` are specified, only
+        the states of these resources are updated.
         """
 
-        # read all of the old storage states first, then over write
-        # the old states with the current states before writing to a
-        # CSV. this is important for situations where a subgraph is
+        # over write the old states with the current states before
+        # writing to a CSV. old states are kept in the state_store,
+        # which is important for situations where a subgraph is
         # selected to run
-        after_resource_states = self.read_from_storage(self.abs_state_path)
-        for name, resource in self.resource_dict.iteritems():
-            after_resource_states[name] = resource.get_current_state()
+        is_complete = resources is None and not self.is_subgraph
+        if resources is None:
+            resources = self.resource_dict.values()
+        self.state_cache.prefetch(resources, self.hash_pool)
+        after_resource_states = {}
+        for resource in resources:
+            after_resource_states[resource.name] = resource.get_cached_state()
+
+        self.state_store.update(after_resource_states)
+
+        # store the stat fingerprints of all of the files that were
+        # hashed during this run next to their hashes
+        fingerprints = self.state_cache.fingerprints.items()
+        self.state_store.update(
+            dict((k, state) for k, (state, stat) in fingerprints),
+            dict((k, stat) for k, (state, stat) in fingerprints),
+        )
+
+        # every file of every resource is hashed when the states of all
+        # resources of the entire graph are saved, so the fingerprints
+        # of files that were not seen (because they were deleted or
+        # renamed) are stale
+        if is_complete:
+            self.state_store.prune('file:', self.state_cache.fingerprints)
 
         # if override states are provided, update the resources
         # accordingly
         if isinstance(override_resource_states, dict):
-            after_resource_states.update(override_resource_states)
+            self.state_store.update(override_resource_states)
 
-        self.write_to_storage(after_resource_states, self.abs_state_path)
-        self.write_to_storage(self.task_durations, self.abs_duration_path)
+        self.state_store.save()
+
+    def get_archive_files(self, exclude_internals=False):
+        """Get the (filename, resource) of all of the files that should be
+        archived based on the current workflow specification, where
+        filenames are relative to the root of the workflow. Directories
+        are archived file by file.
+        """
+        names = set([os.path.basename(self.config_path)])
+        if not exclude_internals:
+            names.update([self.state_path, self.history_path, self.log_path])
+        for task in self.task_list:
+            names.update(task.get_all_filenames())
+
+        # resources that are not part of the workflow (like the files in
+        # .workflow/) are created without adding them to the graph
+        files = {}
+        for resource in resources.get_or_create(self, names, register=False):
+            if os.path.isdir(resource.resource_path):
+                for path in resource.iter_filenames():
+                    files[resource.relative_name(path)] = resource
+            elif os.path.exists(resource.resource_path):
+                files[resource.name] = resource
+        return sorted(files.iteritems())
+
+    def get_archived_states(self, archive_store):
+        """Get the (state, stat fingerprint) of every file in the most
+        recent archive, keyed by filename
+        """
+        manifests = [
+            a for a in self.get_abs_available_archives() if a.endswith('.csv')
+        ]
+        if not manifests:
+            return {}
+        entries = archive_store.read_manifest(os.path.basename(manifests[-1]))
+        return dict(
+            (filename, (state, stat))
+            for filename, mode, state, stat in entries
+        )
+
+    def get_known_state(self, filename, resource, path, stat, archived):
+        """Get the state of a file that was already hashed, during this run
+        or when it was last run or archived with the same contents, to
+        avoid hashing it again. Files that match the `sampled_hash`
+        patterns are always hashed since their states might be sampled.
+        """
+        if resource.is_sampled(path):
+            return None
+        if filename == resource.name and filename in self.state_cache.states:
+            return self.state_cache.states[filename]
+        name = 'file:' + filename
+        candidates = [
+            self.state_cache.fingerprints.get(name),
+            (self.state_store.get(name), self.state_store.get_stat(name)),
+            archived.get(filename),
+        ]
+        for state, known_stat in filter(None, candidates):
+            algorithm = resources.hashing.get_state_algorithm(state)
+            if known_stat == stat and algorithm == self.hash_algorithm:
+                return state
+        return None
+
+    def _archive_file(self, archive_store, archived, filename, resource):
+        """Add the file to the archive_store unless an identical file has
+        already been archived
+        """
+        path = os.path.join(self.root_directory, filename)
+        stat = resources.file_system.stat_fingerprint(path)
+        state = self.get_known_state(filename, resource, path, stat, archived)
+        if state is None:
+            state = resource.content_state(path)
+        mode = os.stat(path).st_mode & 0777
+        is_new = archive_store.add(path, state)
+        return (filename, mode, state, stat), is_new
 
     def write_archive(self, exclude_internals=False):
-        """Method to backup the current workflow
+        """Method to backup the current workflow. Files are stored by their
+        contents (see storage.ArchiveStore) so that every archive only
+        compresses and stores the files that changed since previous
+        archives. Files are compressed concurrently by the hash_pool.
         """
 
         # for now, create archives based on the date.
@@ -429,42 +813,89 @@ class TaskGraph(object):
         # dates for now to make it easy to identify a good default
         # archive to restore in self.restore_archive (the last one)
         now = datetime.datetime.now()
-        archive_name = os.path.join(
-            self.abs_archive_dir,
-            "%s.tar.bz2" % now.strftime("%Y%m%d%H%M%S"),
+        archive_name = "%s.csv" % now.strftime("%Y%m%d%H%M%S")
+        archive_store = storage.ArchiveStore(self.abs_archive_dir)
+        archived = self.get_archived_states(archive_store)
+        results = self.hash_pool.map(
+            lambda item: self._archive_file(archive_store, archived, *item),
+            self.get_archive_files(exclude_internals),
         )
-
-        # get the set of all filenames that should be archived based
-        # on the current workflow specification
-        all_filenames = set([os.path.basename(self.config_path)])
-        if not exclude_internals:
-            all_filenames.update(set([
-                self.state_path,
-                self.duration_path,
-                self.log_path,
-            ]))
-        for task in self.task_list:
-            all_filenames.update(task.get_all_filenames())
-
-        # create the archive. filenames are ordered here so that the
-        # corresponding archive will have a consistent md5 hash (which is
-        # used in functional tests).
-        command = "tar cjf %s %s" % (
-            archive_name,
-            ' '.join(sorted(all_filenames)),
+        archive_store.write_manifest(
+            archive_name, [entry for entry, is_new in results],
         )
-        self.logger.info(colors.bold_white(command))
-        shell.run(self.root_directory, command)
+        self.logger.info(colors.bold_white(
+            "archived %d files (%d new) in %s" % (
+                len(results), sum(is_new for entry, is_new in results),
+                os.path.join(self.archive_dir, archive_name),
+            )
+        ))
+
+    def get_restore_filenames(self, task_ids):
+        """Get the names of the `creates` of the tasks that match any of the
+        `task_ids` (see find_tasks), which are restored from archives
+        """
+        filenames = set()
+        for task in self.find_tasks(task_ids):
+            if not task.is_pseudotask():
+                filenames.update(task.creates_list)
+        return sorted(filenames)
 
-    def restore_archive(self, archive):
+    def _restore_file(self, archive_store, filename, mode, state, stat):
+        """Extract the file from the archive_store unless the current file
+        already has the same contents. Returns whether it was extracted.
+        """
+        path = os.path.join(self.root_directory, filename)
+        if os.path.isfile(path):
+            resource = resources.get_or_create(
+                self, [filename], register=False,
+            )[0]
+            algorithm = resources.hashing.get_state_algorithm(state)
+            if resource.content_state(path, algorithm) == state:
+                os.chmod(path, mode)
+                return False
+        archive_store.extract(state, path, mode)
+        return True
+
+    def restore_archive(self, archive, task_ids=None):
         """Method to restore a previous archived workflow specified in
         `archive`. The archive path should be relative to the root of
-        the project.
+        the project. If `task_ids` are specified, only the `creates` of
+        these tasks are restored.
         """
         archive_name = os.path.join(self.root_directory, archive)
-        command = "tar xjf %s" % archive_name
-        self.logger.info(colors.bold_white(command))
-        shell.run(self.root_directory, command)
+        filenames = None
+        if task_ids:
+            filenames = self.get_restore_filenames(task_ids)
+
+        # archives used to be stored as tarballs
+        if archive_name.endswith('.tar.bz2'):
+            command = "tar xjf %s %s" % (
+                archive_name, ' '.join(filenames or []),
+            )
+            self.logger.info(colors.bold_white(command))
+            shell.run(self.root_directory, command)
+            return
+
+        # files are decompressed straight from the blobs in the archive
+        # into place, concurrently, skipping any identical files
+        archive_store = storage.ArchiveStore(self.abs_archive_dir)
+        entries = archive_store.read_manifest(os.path.basename(archive_name))
+        if filenames is not None:
+            entries = [
+                entry for entry in entries if any(
+                    entry[0] == filename or
+                    entry[0].startswith(filename.rstrip('/') + '/')
+                    for filename in filenames
+                )
+            ]
+        is_restored = self.hash_pool.map(
+            lambda entry: self._restore_file(archive_store, *entry), entries,
+        )
+        self.logger.info(colors.bold_white(
+            "restored %d files (%d unchanged) from %s" % (
+                sum(is_restored), len(entries) - sum(is_restored), archive,
+            )
+        ))
 
     def get_available_archives(self):
         """Method to list all of the available archives"""
@@ -474,6 +905,10 @@ class TaskGraph(object):
 
     def get_abs_available_archives(self):
         """Method to list all of the available archives"""
-        available_archives = glob.glob(os.path.join(self.abs_archive_dir, '*'))
+        available_archives = []
+        for pattern in ('*.csv', '*.tar.bz2'):
+            available_archives.extend(
+                glob.glob(os.path.join(self.abs_archive_dir, pattern))
+            )
         available_archives.sort()
         return available_archives
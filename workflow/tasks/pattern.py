@@ -0,0 +1,83 @@
+r"""Pattern tasks fan out into one task for every file that matches a
+regular expression in their `depends`, like this:
+
+    creates: data/per_file/{{filename_root}}.dat
+    depends:
+      - src/process_each_file.py
+      - data/first/(?P<filename_root>\w+).dat
+    command: python {{depends[0]}} {{depends[1]}} > {{creates}}
+
+The named groups of the regular expression are available as templating
+variables in every one of the tasks. With a `batch` size, up to that
+many of these tasks run at once with a single command that lists all of
+their files in `{{depends_batch}}` (and the values of their other
+variables, like `{{creates_batch}}`).
+"""
+
+import os
+import re
+
+from ..exceptions import InvalidTaskDefinition
+from .task import _cast_as_list
+
+
+def _is_pattern(dependency):
+    return isinstance(dependency, basestring) and '(?P<' in dependency
+
+
+def get_pattern(task_kwargs):
+    """Get the pattern in the `depends` of a task, if there is one"""
+    patterns = filter(_is_pattern, _cast_as_list(task_kwargs.get('depends')))
+    if len(patterns) > 1:
+        raise InvalidTaskDefinition(
+            "tasks can only depend on one pattern, not %s" % patterns
+        )
+    return patterns[0] if patterns else None
+
+
+def split_pattern(pattern):
+    """Split a pattern into the directory that is searched for matching
+    files and the compiled regular expression that matches their names
+    """
+    directory, name_pattern = os.path.split(pattern)
+    if '(?P<' in directory:
+        raise InvalidTaskDefinition(
+            "only the file name of pattern '%s' can contain groups" % pattern
+        )
+    try:
+        return directory, re.compile(name_pattern + '$')
+    except re.error, e:
+        raise InvalidTaskDefinition(
+            "invalid pattern '%s' (%s)" % (pattern, e)
+        )
+
+
+def expand(task_kwargs, root_directory, directory_listings):
+    """Iterate over the keyword arguments of one task for every file that
+    matches the pattern in the `depends` of `task_kwargs`, in order of
+    their file names.
+    """
+    pattern = get_pattern(task_kwargs)
+    directory, regex = split_pattern(pattern)
+    names = directory_listings.listdir(os.path.join(root_directory, directory))
+    for name in sorted(names):
+        match = regex.match(name)
+        if match is None:
+            continue
+        dependency = os.path.join(directory, name)
+        kwargs = dict(task_kwargs)
+        kwargs.pop('alias', None)
+        if isinstance(kwargs['depends'], (list, tuple)):
+            kwargs['depends'] = [
+                dependency if d == pattern else d for d in kwargs['depends']
+            ]
+        else:
+            kwargs['depends'] = dependency
+        kwargs.update(match.groupdict())
+
+        # tasks with a `batch` size run in batches that share a single
+        # command, where the variables that are different in every
+        # task are listed for all of them, like depends_batch (see
+        # Task.render_batch_command)
+        kwargs['batch_item'] = dict(match.groupdict(), depends=dependency)
+        yield kwargs
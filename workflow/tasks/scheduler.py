@@ -0,0 +1,219 @@
+"""Dependency-aware execution of tasks so that independent branches of
+a workflow can run concurrently.
+"""
+
+import collections
+import heapq
+import threading
+import time
+import Queue
+
+from .batch import Batch
+
+
+class Scheduler(object):
+    """Run a topologically ordered list of `tasks` with at most `jobs`
+    tasks running at the same time. A task is started as soon as all
+    of its upstream tasks have finished and the states of resources
+    are saved periodically as tasks complete. After the first failure,
+    no new tasks are started and the error is re-raised once the
+    running tasks have finished.
+    """
+
+    # saving rewrites the entire state file, so the states of completed
+    # tasks are saved at most every save_interval seconds (and whenever
+    # the run stops)
+    save_interval = 5
+
+    def __init__(self, graph, tasks, do_run_func, jobs=1):
+        self.graph = graph
+        self.do_run_func = do_run_func
+        self.jobs = max(jobs, 1)
+
+        # the order of the tasks is used to break ties among the tasks
+        # that are ready to run so that running with a single job is
+        # deterministic. ready tasks that can run in batches are also
+        # queued by their batch_key so that they can be started
+        # together (and are skipped when they come up in self.ready)
+        self.order = dict((task, i) for i, task in enumerate(tasks))
+        task_set = set(tasks)
+        self.n_upstream = {}
+        self.ready = []
+        self.ready_batches = collections.defaultdict(collections.deque)
+        self.started = set()
+        for task in tasks:
+            self.n_upstream[task] = len(task.upstream_tasks & task_set)
+            if self.n_upstream[task] == 0:
+                self.push_ready(task)
+
+        # count how many tasks still need to check the state of every
+        # resource. states are only saved once nothing else in this
+        # run depends on them (otherwise a downstream task could
+        # appear to be in sync after an interruption) unless the run
+        # stops early, in which case the pending tasks are marked to be
+        # re-run instead (see save_failures)
+        self.n_consumers = collections.Counter()
+        for task in tasks:
+            if not task.is_pseudotask():
+                self.n_consumers.update(task.depends_resources)
+        self.unsaved = set()
+        self.saveable = set()
+        self.last_save_time = time.time()
+        self.completed = set()
+
+        # tasks (or batches of tasks) that are currently running
+        self.running = set()
+        self.finished = Queue.Queue()
+        self.failures = []
+
+    def run(self):
+        try:
+            while self.running or (self.ready and not self.failures):
+                self.start_ready_tasks()
+                if self.running:
+                    self.complete_run(*self.wait())
+        except KeyboardInterrupt:
+            for run in self.running:
+                self.failures.extend(
+                    (task, None) for task in getattr(run, 'tasks', [run])
+                )
+            self.save_failures()
+            raise
+        if self.failures:
+            self.save_failures()
+            raise self.failures[0][1]
+        self.save()
+
+    def push_ready(self, task):
+        heapq.heappush(self.ready, (self.order[task], task))
+        if task.batch_size > 1:
+            self.ready_batches[task.batch_key].append(task)
+
+    def start_ready_tasks(self):
+        while self.ready and len(self.running) < self.jobs:
+            if self.failures:
+                return
+            dummy, task = heapq.heappop(self.ready)
+            if task in self.started:
+                continue
+            self.started.add(task)
+            if self.do_run_func(task):
+                run = task
+                if task.batch_size > 1:
+                    run = Batch([task] + self.pop_batch(task))
+
+                # prefix the output of every task with its id when
+                # several tasks run at the same time
+                if self.jobs > 1:
+                    run.output_prefix = "%s| " % task.id
+                self.running.add(run)
+                thread = threading.Thread(target=self.run_task, args=(run,))
+                thread.daemon = True
+                thread.start()
+            else:
+                self.complete(task, None, ran=False)
+
+    def pop_batch(self, task):
+        """Get up to task.batch_size - 1 other ready tasks that need to run
+        in the same batch as `task`
+        """
+        batch, queue = [], self.ready_batches[task.batch_key]
+        while queue and len(batch) < task.batch_size - 1:
+            other_task = queue.popleft()
+            if other_task not in self.started:
+                self.started.add(other_task)
+                if self.do_run_func(other_task):
+                    batch.append(other_task)
+                else:
+                    self.complete(other_task, None, ran=False)
+        return batch
+
+    def run_task(self, run):
+        """Run a task (or a batch of tasks) in a worker thread and report
+        back to the main thread through the self.finished queue.
+        """
+        try:
+            run.timed_run()
+        except Exception, e:
+            self.finished.put((run, e))
+        else:
+            self.finished.put((run, None))
+
+    def wait(self):
+        # waiting with a timeout keeps the main thread responsive to
+        # KeyboardInterrupts in python 2
+        while True:
+            try:
+                return self.finished.get(timeout=1)
+            except Queue.Empty:
+                pass
+
+    def complete_run(self, run, error):
+        """Complete a task or every task in a batch. When a batch fails, the
+        tasks that it finished anyway are completed successfully.
+        """
+        self.running.discard(run)
+        if not isinstance(run, Batch):
+            self.complete(run, error)
+            return
+        finished_tasks = set()
+        if error is not None:
+            finished_tasks = run.get_finished_tasks()
+        for task in run.tasks:
+            self.complete(task, None if task in finished_tasks else error)
+
+    def complete(self, task, error, ran=True):
+        if error is not None:
+            self.failures.append((task, error))
+            return
+        self.completed.add(task)
+        for downstream_task in task.downstream_tasks:
+            if downstream_task in self.n_upstream:
+                self.n_upstream[downstream_task] -= 1
+                if self.n_upstream[downstream_task] == 0:
+                    self.push_ready(downstream_task)
+        self.save_completed(task, ran)
+
+    def save_completed(self, task, ran):
+        """Save the state of this task and of the resources it used or
+        created that no other pending task depends on.
+        """
+        if not task.is_pseudotask():
+            self.n_consumers.subtract(task.depends_resources)
+        if ran:
+            self.unsaved.add(task)
+            self.unsaved.update(task.depends_resources)
+            self.unsaved.update(task.creates_resources)
+        saveable = [r for r in self.unsaved if self.n_consumers[r] <= 0]
+        self.saveable.update(saveable)
+        self.unsaved.difference_update(saveable)
+        if time.time() - self.last_save_time >= self.save_interval:
+            self.save()
+
+    def save(self, override_resource_states=None):
+        """Save the states of all of the resources that can be saved"""
+        if self.saveable or override_resource_states:
+            self.graph.save_state(
+                override_resource_states=override_resource_states,
+                resources=list(self.saveable),
+            )
+            self.saveable.clear()
+        self.last_save_time = time.time()
+
+    def save_failures(self):
+        """Save the states of all of the resources that completed tasks used
+        or created, even if failed or pending tasks also depend on
+        them, and make sure that those tasks are re-run next time
+        (otherwise they could appear to be in sync).
+        """
+        failed_tasks = set(task for task, error in self.failures)
+        override_resource_states = {}
+        for task in self.order:
+            if task in self.completed or task.is_pseudotask():
+                continue
+            if task in failed_tasks or \
+                    self.unsaved.intersection(task.depends_resources):
+                override_resource_states[task.name] = ''
+        self.saveable.update(self.unsaved)
+        self.unsaved.clear()
+        self.save(override_resource_states)
@@ -1,14 +1,18 @@
 import os
 import time
+import datetime
+import socket
 import StringIO
 import copy
 
 import jinja2
+import jinja2.meta
 
-from ..exceptions import InvalidTaskDefinition
+from ..exceptions import InvalidTaskDefinition, ShellError
 from .. import colors
 from .. import shell
 from .. import resources
+from .. import storage
 
 
 def _cast_as_list(obj):
@@ -24,8 +28,26 @@ def _cast_as_list(obj):
 
 class Task(resources.base.BaseResource):
 
+    # attributes that are stored by Task.compile
+    compiled_attributes = (
+        '_creates', '_depends', '_command', '_alias', '_kwargs', 'attrs',
+        'creates', 'depends', 'alias', 'command', '_batch', '_batch_item',
+    )
+
+    # prefix of every line of output of the commands of this task,
+    # which is set when several tasks run at the same time
+    output_prefix = ''
+
+    @property
+    def log_extra(self):
+        """The messages about this task and the output of its commands are
+        logged with its id so that they are stored in the log of this
+        task (see logger.TaskLogHandler)
+        """
+        return {'task_ids': [self.id]}
+
     def __init__(self, graph, creates=None, depends=None, alias=None,
-                 command=None, **kwargs):
+                 command=None, batch=None, batch_item=None, **kwargs):
         self.graph = graph
         self._creates = creates
         self._depends = depends
@@ -33,6 +55,12 @@ class Task(resources.base.BaseResource):
         self._alias = alias
         self._kwargs = copy.deepcopy(kwargs)
 
+        # the `batch` size of tasks that were expanded from a pattern
+        # task only changes how they run (see render_batch_command),
+        # so it is neither a template variable nor part of the state
+        self._batch = batch
+        self._batch_item = batch_item or {}
+
         # quick type checking to make sure the tasks in the
         # configuration file are valid
         if self._creates is None:
@@ -63,7 +91,27 @@ class Task(resources.base.BaseResource):
         # the state of this command and render the jinja template for
         # the command
         self.command = self.render_command_template()
+        self._add_to_graph()
+
+    @classmethod
+    def from_compiled(cls, graph, compiled):
+        """Create a Task from the attributes returned by Task.compile without
+        rendering any of its templates again.
+        """
+        task = cls.__new__(cls)
+        task.graph = graph
+        task.__dict__.update(compiled)
+        task._add_to_graph()
+        return task
+
+    def compile(self):
+        """Get the attributes of this task after all of its templates have
+        been rendered so that it can be quickly recreated with
+        Task.from_compiled.
+        """
+        return dict((k, self.__dict__[k]) for k in self.compiled_attributes)
 
+    def _add_to_graph(self):
         # add this task to the task graph
         self.graph.add(self)
 
@@ -103,6 +151,8 @@ class Task(resources.base.BaseResource):
             "command": self._command,
             "alias": self._alias,
         })
+        if self._batch is not None:
+            out["batch"] = self._batch
         return out
 
     @property
@@ -139,7 +189,7 @@ class Task(resources.base.BaseResource):
             all_filenames.add(resource.get_filename())
         return all_filenames
 
-    def get_current_state(self):
+    def get_current_state(self, algorithm=None):
         """Get the state of this task"""
         # write the data for this task to a stream so that we can use
         # the machinery in self.get_stream_state to calculate the
@@ -150,7 +200,9 @@ class Task(resources.base.BaseResource):
         keys.sort()
         for k in keys:
             msg += k + str(self.attrs[k])
-        return self.get_stream_state(StringIO.StringIO(msg))
+        return self.get_stream_state(
+            StringIO.StringIO(msg), algorithm=algorithm,
+        )
 
     def is_pseudotask(self):
         """Check to see if this task is a pseudotask.
@@ -168,17 +220,22 @@ class Task(resources.base.BaseResource):
             return False
 
         # if this task or any of its dependencies are out of sync,
-        # then this task must be executed. We use `all` here to
-        # deliberately stop checking states when any resource state is
-        # out of sync (this is more computationally efficient for
-        # checking large file hashes)
-        return self.state_in_sync() and all(
+        # then this task must be executed. The dependencies are only
+        # hashed (concurrently) when the task itself is in sync.
+        if not self.state_in_sync():
+            return False
+        self.graph.state_cache.prefetch(
+            self.depends_resources, self.graph.hash_pool,
+        )
+        return all(
             resource.state_in_sync() for resource in self.depends_resources
         )
 
     def run(self, command):
         """Run the specified shell command using Fabric-like behavior"""
-        return shell.run(self.root_directory, command)
+        return shell.run(
+            self.root_directory, command, self.output_prefix, self.log_extra,
+        )
 
     def clean_command(self):
         return "rm -rf %s" % self.creates
@@ -187,6 +244,7 @@ class Task(resources.base.BaseResource):
         """Remove the specified target"""
         if not self.is_pseudotask():
             self.run(self.clean_command())
+            self.graph.state_cache.invalidate(self.creates_resources)
             self.graph.logger.info("removed %s" % self.creates_message())
 
     def mock_run(self):
@@ -199,26 +257,124 @@ class Task(resources.base.BaseResource):
         # useful message about starting this task and what it is
         # called so users know how to re-call this task if they
         # notice something fishy during execution.
-        self.graph.logger.info(self.creates_message())
+        self.graph.logger.info(self.creates_message(), extra=self.log_extra)
         start_time = time.time()
 
-        # run each command for this task
-        for command in self.command_list:
-            self.graph.logger.info(self.command_message(command))
-            self.run(command)
+        # run each command for this task. whether or not the commands
+        # succeed, the resources this task creates have (potentially)
+        # changed and need to be hashed again
+        exit_code = 1
+        try:
+            for command in self.command_list:
+                self.graph.logger.info(
+                    self.command_message(command), extra=self.log_extra,
+                )
+                self.run(command)
+            exit_code = 0
+        except ShellError, e:
+            exit_code = e.exit_code
+            raise
+        finally:
+            self.graph.state_cache.invalidate(self.creates_resources)
+
+            # stop the clock and record the time spent running the
+            # task in the duration history
+            self.duration = time.time() - start_time
+            self.graph.history.append(storage.TaskRun(
+                datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
+                self.id, self.duration, exit_code, socket.gethostname(),
+                self.get_input_size(),
+            ))
+
+        # alert the user to the clock time spent running the task
+        self.graph.logger.info(self.duration_message(), extra=self.log_extra)
+
+    @property
+    def batch_size(self):
+        """Maximum number of tasks that were expanded from the same pattern
+        task that can run together with a single command
+        """
+        return int(self._batch or 1)
+
+    @property
+    def batch_key(self):
+        """Tasks with the same batch_key were expanded from the same pattern
+        task
+        """
+        return (self._creates, str(self._command))
 
-        # stop the clock and alert the user to the clock time spent
-        # running the task
-        self.duration = time.time() - start_time
-        self.graph.logger.info(self.duration_message())
+    @property
+    def batch_item(self):
+        """Values of the template variables that are different in every task
+        that was expanded from the same pattern task: its `creates`, the
+        named groups of the pattern and the file that matched it, which
+        is its `depends`
+        """
+        return dict(self._batch_item, creates=self.creates)
 
-        # store the duration on the graph object
-        self.graph.task_durations[self.id] = self.duration
+    @property
+    def batch_variables(self):
+        """Names of the template variables that would only refer to the
+        first task of a batch. `depends` is not one of them since it also
+        lists the dependencies that all of the tasks share.
+        """
+        return sorted(name for name in self.batch_item if name != 'depends')
+
+    def check_batch_command(self):
+        """Make sure that the command of batches of this task does not use
+        any batch_variables
+        """
+        used = set()
+        for command in _cast_as_list(self._command):
+            ast = self.graph.template_environment.parse(command)
+            used.update(jinja2.meta.find_undeclared_variables(ast))
+        used.intersection_update(self.batch_variables)
+        if used:
+            raise InvalidTaskDefinition(
+                "the command of a task with a `batch` size can not use %s "
+                "(use %s instead)" % (
+                    ', '.join(sorted(used)),
+                    ', '.join(name + '_batch' for name in sorted(used)),
+                )
+            )
+
+    def render_batch_command(self, tasks):
+        """Render the command of this task for a batch of `tasks` that share
+        its batch_key. Every variable of their batch_item is listed for
+        all of them, like `depends_batch` lists their matching files.
+        """
+        context = dict(self.attrs)
+        for name in self.batch_variables:
+            del context[name]
+        items = [task.batch_item for task in tasks]
+        for name in self.batch_item:
+            context[name + '_batch'] = [item[name] for item in items]
+        return [
+            self.graph.get_template(command).render(context)
+            for command in _cast_as_list(self._command)
+        ]
+
+    def get_input_size(self):
+        """Total size, in bytes, of all of the resources this task depends
+        on. The size of every resource is only computed once per run.
+        """
+        return sum(
+            self.graph.state_cache.get_size(r) for r in self.depends_resources
+        )
 
     def _render_template_helper(self, template_str):
-        env = jinja2.Environment()
-        template_obj = env.from_string(template_str)
-        return template_obj.render(self.attrs)
+
+        # strings without any template syntax (like most `creates` in
+        # generated workflows) render to themselves
+        if '{' not in template_str and not template_str.endswith('\n'):
+            return unicode(template_str)
+        template_obj = self.graph.get_template(template_str)
+        try:
+            return template_obj.render(self.attrs)
+        except jinja2.UndefinedError, e:
+            raise InvalidTaskDefinition(
+                "%s in template '%s'" % (e.message, template_str)
+            )
 
     def render_template(self, template):
         """Render a `template` using self.attrs as a template context.
@@ -266,5 +422,6 @@ class Task(resources.base.BaseResource):
     def __repr__(self):
         return '\n'.join(
             [self.creates_message()] +
-            [self.command_message(command=command) for command in self.command]
+            [self.command_message(command=command)
+             for command in self.command_list]
         )